@@ -0,0 +1,90 @@
+from bisect import bisect_left, insort
+from datetime import date
+
+import occupancy
+from models import Room
+
+
+def overlaps(room, start, end):
+    """
+    checks if any stay on the room overlaps the night range [start, end)
+    :param room: room object
+    :param start: first night, date
+    :param end: check out date, exclusive
+    :return:
+    """
+    stays = room.stays or []
+    # stays are sorted and never overlap, so only the last stay starting before end can intersect
+    index = bisect_left([stay[0] for stay in stays], end.toordinal())
+    return index > 0 and stays[index - 1][1] > start.toordinal()
+
+
+def has_stays(room):
+    """
+    checks if any stay on the room has not ended yet, undated bookings hold the room indefinitely and exclude them
+    :param room: room object
+    :return:
+    """
+    today = date.today().toordinal()
+    return any(stay[1] > today for stay in room.stays or [])
+
+
+def reserve(room, start, end, booking_id):
+    """
+    adds a stay to the room's interval index, dropping stays that have already ended
+    :param room: room object, put by the caller
+    :param start: check in date
+    :param end: check out date, exclusive
+    :param booking_id: id of the booking holding the stay
+    :return: False if the range overlaps an existing stay
+    """
+    if overlaps(room, start, end):
+        return False
+
+    today = date.today().toordinal()
+    stays = [stay for stay in room.stays or [] if stay[1] > today]
+    insort(stays, [start.toordinal(), end.toordinal(), booking_id])
+    room.stays = stays
+    occupancy.mark(room, start, end, True)
+    return True
+
+
+def release(room, booking_id):
+    """
+    removes a booking's stay from the room's interval index
+    :param room: room object, put by the caller
+    :param booking_id:
+    :return:
+    """
+    for start, end, stay_booking_id in room.stays or []:
+        if stay_booking_id == booking_id:
+            occupancy.mark(room, date.fromordinal(start), date.fromordinal(end), False)
+    room.stays = [stay for stay in room.stays or [] if stay[2] != booking_id]
+
+
+def free_rooms(start, end):
+    """
+    returns every room with no stay overlapping [start, end) and not held by an undated booking,
+    read in a single batched query.
+    Ranges inside the occupancy window are answered from the nightly bitmaps, others from the stay lists
+    :param start: check in date
+    :param end: check out date, exclusive
+    :return: list of room objects
+    """
+    rooms = [room for room in Room.query().fetch() if not room.is_booked]
+    if occupancy.covers(start, end):
+        return occupancy.free_rooms(rooms, start, end)
+    return [room for room in rooms if not overlaps(room, start, end)]
+
+
+def nightly_occupancy(start, end):
+    """
+    occupied room count and percentage for every night in [start, end), which must be inside the occupancy window.
+    Rooms held by an undated booking count as occupied from today on
+    :param start: date
+    :param end: date, exclusive
+    :return: list of (date, occupied rooms, percent occupied) tuples
+    """
+    rooms = Room.query().fetch()
+    return [(night, count, 100.0 * count / len(rooms) if rooms else 0.0)
+            for night, count in occupancy.occupancy_by_night(rooms, start, end)]
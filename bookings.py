@@ -0,0 +1,180 @@
+from datetime import datetime
+import logging
+import random
+import time
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+import availability
+import counters
+from models import Booking, Room, Tombstone, allocate_key
+
+# attempts made when a booking transaction collides with a concurrent write
+MAX_ATTEMPTS = 5
+# base delay in seconds, doubled after every failed attempt
+BACKOFF = 0.05
+
+
+class BookingError(Exception):
+    """
+    raised when a booking cannot be made
+    """
+    def __init__(self, field, message):
+        super(BookingError, self).__init__(message)
+        self.field = field
+        self.message = message
+
+
+def run_with_retries(func, *args, **kwargs):
+    """
+    runs a transactional tasklet, retrying with exponential backoff and jitter when the transaction collides
+    :param func: function decorated with ndb.transactional_tasklet(retries=0)
+    :return: result of func
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return func(*args, **kwargs).get_result()
+        except datastore_errors.TransactionFailedError:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            delay = BACKOFF * (2 ** attempt)
+            logging.info('%s collided, retrying in %.3fs', func.__name__, delay)
+            time.sleep(delay + random.uniform(0, delay))
+
+
+@ndb.transactional_tasklet(xg=True, retries=0)
+def _create_booking(key, customer_id, room_number, check_in, check_out):
+    room = yield Room.key_for_number(room_number).get_async()
+    if room is None:
+        raise BookingError('room_number', 'Room with number - {} does not exist'.format(room_number))
+
+    booking = Booking(key=key, id=str(key.id()), customerID=customer_id, room_number=room_number, is_active=True,
+                      check_in=check_in, check_out=check_out, booked_at=datetime.utcnow())
+    # an undated booking holds the room through is_booked until it is cancelled, so it excludes every stay
+    if room.is_booked:
+        raise BookingError('room_number', 'Room with number - {} already booked'.format(room_number))
+    elif check_in:
+        if not availability.reserve(room, check_in, check_out, booking.id):
+            raise BookingError('check_in', 'Room with number - {} is not available from {} to {}'.format(
+                room_number, check_in, check_out))
+    elif availability.has_stays(room):
+        raise BookingError('room_number', 'Room with number - {} has upcoming stays'.format(room_number))
+    else:
+        room.is_booked = True
+
+    # the booking, room and counter shard writes are independent and go out together
+    futures = ndb.put_multi_async([booking, room])
+    futures.append(counters.increment_async(counters.version(Booking._get_kind())))
+    futures.append(counters.increment_async(counters.version(Room._get_kind())))
+    futures.append(counters.increment_async(counters.BOOKINGS))
+    futures.append(counters.increment_async(counters.ACTIVE_BOOKINGS))
+    if not check_in:
+        futures.append(counters.increment_async(counters.OCCUPIED_ROOMS))
+    yield futures
+    raise ndb.Return(booking)
+
+
+def create_booking(customer_id, room_number, check_in=None, check_out=None):
+    """
+    reserves the room and creates the booking in one cross-group transaction.
+    Bookings with dates reserve the stay in the room's interval index, bookings without dates flip Room.is_booked
+    :param customer_id: customer id
+    :param room_number: room number
+    :param check_in: check in date, optional
+    :param check_out: check out date, exclusive, required with check_in
+    :return: booking object
+    :raises BookingError: if the room does not exist or is not available
+    """
+    return run_with_retries(_create_booking, allocate_key(Booking), customer_id, int(room_number),
+                            check_in, check_out)
+
+
+@ndb.transactional_tasklet(xg=True, retries=0)
+def _set_active(key, is_active):
+    booking = yield key.get_async()
+    if booking is None:
+        raise ndb.Return(None)
+
+    is_active = bool(is_active)
+    active_delta = int(is_active) - int(bool(booking.is_active))
+    room = yield Room.key_for_number(booking.room_number).get_async()
+    entities = [booking]
+
+    # the room only changes when the booking does, a repeated cancel must not free a room another booking holds
+    occupied_delta = 0
+    if active_delta > 0 and room is not None and room.is_booked:
+        raise BookingError('is_active', 'Room with number - {} already booked'.format(booking.room_number))
+
+    if room is not None and active_delta and booking.check_in:
+        if active_delta > 0 and not availability.reserve(room, booking.check_in, booking.check_out, booking.id):
+            raise BookingError('is_active', 'Room with number - {} is not available from {} to {}'.format(
+                booking.room_number, booking.check_in, booking.check_out))
+        elif active_delta < 0:
+            availability.release(room, booking.id)
+        entities.append(room)
+    elif room is not None and active_delta:
+        if active_delta > 0 and availability.has_stays(room):
+            raise BookingError('is_active', 'Room with number - {} has upcoming stays'.format(
+                booking.room_number))
+        occupied_delta = int(is_active) - int(bool(room.is_booked))
+        room.is_booked = is_active
+        entities.append(room)
+
+    booking.is_active = is_active
+    futures = ndb.put_multi_async(entities)
+    futures.extend(counters.increment_async(counters.version(entity.key.kind())) for entity in entities)
+    if active_delta:
+        futures.append(counters.increment_async(counters.ACTIVE_BOOKINGS, active_delta))
+    if occupied_delta:
+        futures.append(counters.increment_async(counters.OCCUPIED_ROOMS, occupied_delta))
+    yield futures
+    raise ndb.Return(booking)
+
+
+def set_active(booking_id, is_active):
+    """
+    activates or cancels a booking, updating the room in the same transaction
+    :param booking_id: booking id
+    :param is_active:
+    :return: booking object or None if it does not exist
+    :raises BookingError: if re-activating a booking whose room has since been taken
+    """
+    return run_with_retries(_set_active, ndb.Key(Booking, int(booking_id)), is_active)
+
+
+@ndb.transactional_tasklet(xg=True, retries=0)
+def _delete_booking(key):
+    booking = yield key.get_async()
+    if booking is None:
+        raise ndb.Return(None)
+
+    futures = [key.delete_async(), counters.increment_async(counters.BOOKINGS, -1),
+               counters.increment_async(counters.version(key.kind()))]
+    futures.extend(ndb.put_multi_async(Tombstone.for_keys([key])))
+    if booking.is_active:
+        futures.append(counters.increment_async(counters.ACTIVE_BOOKINGS, -1))
+
+    if booking.is_active:
+        room = yield Room.key_for_number(booking.room_number).get_async()
+        if room is not None:
+            if booking.check_in:
+                availability.release(room, booking.id)
+            else:
+                # an active undated booking is what holds Room.is_booked
+                if room.is_booked:
+                    futures.append(counters.increment_async(counters.OCCUPIED_ROOMS, -1))
+                room.is_booked = False
+            futures.append(room.put_async())
+            futures.append(counters.increment_async(counters.version(room.key.kind())))
+    yield futures
+    raise ndb.Return(booking)
+
+
+def delete_booking(booking_id):
+    """
+    deletes a booking, releasing its stay from the room's interval index or, without dates, the room itself
+    :param booking_id: booking id
+    :return: deleted booking object or None if it does not exist
+    """
+    return run_with_retries(_delete_booking, ndb.Key(Booking, int(booking_id)))
@@ -0,0 +1,153 @@
+import random
+
+from google.appengine.ext import ndb
+
+# number of shards per counter, bounds write contention on a single counter
+NUM_SHARDS = 20
+
+CUSTOMERS = 'customers'
+ROOMS = 'rooms'
+OCCUPIED_ROOMS = 'occupied_rooms'
+BOOKINGS = 'bookings'
+ACTIVE_BOOKINGS = 'active_bookings'
+
+
+class CounterShard(ndb.Model):
+    """
+    A single shard of a named counter
+    """
+    count = ndb.IntegerProperty(default=0, indexed=False)
+    date_modified = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+def version(kind):
+    """
+    name of the counter holding a kind's version, bumped in the transaction of every write to the kind
+    :param kind: datastore kind, e.g. 'Booking'
+    :return:
+    """
+    return 'version-{}'.format(kind)
+
+
+def shard_keys(name):
+    """
+    returns the keys of all shards for a counter
+    :param name: counter name
+    :return:
+    """
+    return [ndb.Key(CounterShard, '{}-{}'.format(name, index)) for index in range(NUM_SHARDS)]
+
+
+@ndb.tasklet
+def increment_async(name, delta=1):
+    """
+    adds delta to a random shard of the counter.
+    Call from within the (cross-group) transaction that writes the counted entities
+    :param name: counter name
+    :param delta:
+    :return: future
+    """
+    key = random.choice(shard_keys(name))
+    shard = yield key.get_async()
+    shard = shard or CounterShard(key=key)
+    shard.count += delta
+    yield shard.put_async()
+
+
+def increment(name, delta=1):
+    """
+    synchronous increment_async
+    :param name: counter name
+    :param delta:
+    :return:
+    """
+    increment_async(name, delta).get_result()
+
+
+@ndb.tasklet
+def get_counts_async(names):
+    """
+    reads the totals of several counters with a single batch get
+    :param names: list of counter names
+    :return: future of a dict of counter name to total
+    """
+    names = list(names)
+    keys = [shard_keys(name) for name in names]
+    shards = yield ndb.get_multi_async([key for group in keys for key in group])
+
+    totals = {}
+    for index, name in enumerate(names):
+        group = shards[index * NUM_SHARDS:(index + 1) * NUM_SHARDS]
+        totals[name] = sum(shard.count for shard in group if shard)
+
+    raise ndb.Return(totals)
+
+
+def get_counts(names):
+    """
+    synchronous get_counts_async
+    :param names: list of counter names
+    :return: dict of counter name to total
+    """
+    return get_counts_async(names).get_result()
+
+
+@ndb.tasklet
+def get_count_async(name):
+    """
+    reads the total of a counter
+    :param name: counter name
+    :return: future of the total
+    """
+    totals = yield get_counts_async([name])
+    raise ndb.Return(totals[name])
+
+
+def get_count(name):
+    """
+    synchronous get_count_async
+    :param name: counter name
+    :return:
+    """
+    return get_count_async(name).get_result()
+
+
+@ndb.tasklet
+def get_versions_async(kinds):
+    """
+    reads the versions of several kinds with a single batch get
+    :param kinds: list of datastore kinds
+    :return: future of a dict of kind to version and the time of the latest write to any of them, or None
+    """
+    kinds = list(kinds)
+    shards = yield ndb.get_multi_async([key for kind in kinds for key in shard_keys(version(kind))])
+
+    versions = {}
+    for index, kind in enumerate(kinds):
+        group = shards[index * NUM_SHARDS:(index + 1) * NUM_SHARDS]
+        versions[kind] = sum(shard.count for shard in group if shard)
+
+    modified = [shard.date_modified for shard in shards if shard and shard.date_modified]
+    raise ndb.Return((versions, max(modified) if modified else None))
+
+
+def get_versions(kinds):
+    """
+    synchronous get_versions_async
+    :param kinds: list of datastore kinds
+    :return: dict of kind to version, time of the latest write or None
+    """
+    return get_versions_async(kinds).get_result()
+
+
+@ndb.transactional(xg=True)
+def reset(name, value):
+    """
+    overwrites a counter's total, used to rebuild counters from the datastore
+    :param name: counter name
+    :param value: new total
+    :return:
+    """
+    shards = [CounterShard(key=key, count=0) for key in shard_keys(name)]
+    shards[0].count = value
+    ndb.put_multi(shards)
@@ -0,0 +1,86 @@
+from collections import deque
+import itertools
+import threading
+from Queue import Queue
+
+from werkzeug.utils import import_string
+
+from settings import Config
+
+
+class Broker(object):
+    """
+    in-process publish/subscribe fan-out of change events, one queue per subscriber.
+    Events only reach subscribers on the instance that published them, which makes /v1/events a
+    single-instance prototype (see Config.EVENT_STREAM_ENABLED). Set Config.EVENT_BROKER to a class with the same
+    publish/subscribe/unsubscribe methods to fan out through a shared pub/sub service
+    """
+
+    def __init__(self, history_size=Config.EVENT_HISTORY_SIZE):
+        self.history = deque(maxlen=history_size)
+        self.subscribers = set()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def publish(self, event):
+        """
+        numbers the event and hands it to every subscriber
+        :param event: dict with the kind, action and entity or key of the change
+        :return: event id
+        """
+        with self.lock:
+            event = dict(event, event_id=next(self.ids))
+            self.history.append(event)
+            for queue in self.subscribers:
+                queue.put(event)
+        return event['event_id']
+
+    def subscribe(self, last_event_id=None):
+        """
+        registers a subscriber, replaying the kept events after last_event_id for reconnecting clients
+        :param last_event_id: Last-Event-ID sent by the client, optional
+        :return: queue the subscriber's events arrive on
+        """
+        queue = Queue()
+        with self.lock:
+            if last_event_id is not None:
+                for event in self.history:
+                    if event['event_id'] > last_event_id:
+                        queue.put(event)
+            self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        """
+        removes a subscriber
+        :param queue: queue returned by subscribe
+        :return:
+        """
+        with self.lock:
+            self.subscribers.discard(queue)
+
+
+brokers = {}
+
+
+def get_broker():
+    """
+    the instance's broker, created from Config.EVENT_BROKER on first use
+    :return:
+    """
+    if 'broker' not in brokers:
+        brokers['broker'] = import_string(Config.EVENT_BROKER)()
+    return brokers['broker']
+
+
+def publish(kind, action, entity=None, key=None):
+    """
+    publishes a change, call once the write has committed
+    :param kind: datastore kind
+    :param action: 'put' or 'delete'
+    :param entity: written entity, for puts
+    :param key: deleted key, for deletes
+    :return: event id
+    """
+    return get_broker().publish({'kind': kind, 'action': action, 'entity': entity,
+                                 'id': (key or entity.key).id()})
@@ -18,7 +18,7 @@ class LoginForm(Form):
         if not rv:
             return False
 
-        user = User.query(User.username == self.username.data).get()
+        user = User.get_by_username(self.username.data)
         if user is None:
             self.username.errors.append('Unknown username')
             return False
@@ -51,7 +51,7 @@ class RegistrationForm(Form):
         if not rv:
             return False
 
-        user = User.query(User.username == self.username.data).get()
+        user = User.get_by_username(self.username.data)
         if user:
             self.username.errors.append('User with username - {} already exists'.format(self.username.data))
             return False
@@ -67,17 +67,29 @@ class BookingForm(Form):
     customerID = StringField("CustomerID", validators=[DataRequired()])
     room_number = IntegerField("Room", validators=[DataRequired()])
     is_active = BooleanField("Is Active", default=True)
+    check_in = DateField("Check In", validators=[Optional()])
+    check_out = DateField("Check Out", validators=[Optional()])
 
     def validate(self):
         """
-        raises a Validation Error if a room with form request data 'number' already exists
+        raises a Validation Error if the room does not exist, is already booked or the stay dates are invalid
         :return:
         """
         val = Form.validate(self)
         if not val:
             return False
 
-        room = Room.query(Room.number == self.room_number.data).get()
+        if bool(self.check_in.data) != bool(self.check_out.data):
+            self.check_out.errors.append('check_in and check_out must be provided together')
+            return False
+        if self.check_in.data and self.check_out.data <= self.check_in.data:
+            self.check_out.errors.append('check_out must be after check_in')
+            return False
+
+        room = Room.get_by_number(self.room_number.data)
+        if room is None:
+            self.room_number.errors.append('Room with number - {} does not exist'.format(self.room_number.data))
+            return False
         if room.is_booked:
             self.room_number.errors.append('Room with number - {} already booked'.format(self.room_number.data))
             return False
@@ -110,7 +122,7 @@ class RoomForm(Form):
         if not val:
             return False
 
-        room = Room.query(Room.number == self.number.data).get()
+        room = Room.get_by_number(self.number.data)
         if room:
             self.number.errors.append('Room with number - {} already exists'.format(self.number.data))
             return False
@@ -119,6 +131,13 @@ class RoomForm(Form):
         return True
 
 
+class UpdateRoomForm(Form):
+    """
+    Room form to update rooms, the number is part of the room's key and cannot change
+    """
+    is_booked = BooleanField("Is Booked", default=False)
+
+
 class CustomerForm(Form):
     """
     CustomerForm to create new customers
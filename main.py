@@ -9,11 +9,15 @@ from flask_swagger import swagger
 from google.appengine.ext import ndb
 
 from settings import Config
-from models import Booking, Customer, Room, User
+from models import Booking, Customer, Room, User, allocate_key
 from forms import LoginForm, RegistrationForm
-from services import login_required
+from services import login_required, admin_required
+from migrations import migrate_room_keys, index_customers, stamp_sequences
 
-from resources import LoginResource, UserResource, BookingResource, CustomerResource, RoomResource
+from resources import LoginResource, UserResource, BookingResource, CustomerResource, RoomResource, StatsResource, \
+    AvailabilityResource, OccupancyResource, CustomerBatchResource, RoomBatchResource, BookingBatchResource, \
+    CustomerSearchResource, CustomerChangesResource, RoomChangesResource, BookingChangesResource, EventsResource, \
+    DashboardResource, save, response_cache
 
 app = Flask('hotels')
 app.config.from_object(Config)
@@ -57,7 +61,7 @@ def index():
 def login():
     form = LoginForm(request.form)
     if request.method == 'POST':
-        user = User.query(User.username == form.username.data).get()
+        user = User.get_by_username(form.username.data)
         if user and user.check_password(form.password.data):
             session['user_id'] = user.key.id()
             return redirect(url_for('index'))
@@ -72,12 +76,12 @@ def register():
 
     if request.method == 'POST':
         if form.validate():
-            user = User(username=form.username.data, password=hashlib.md5(form.password.data).hexdigest(),
+            user = User(key=allocate_key(User), username=form.username.data,
+                        password=hashlib.md5(form.password.data).hexdigest(),
                         first_name=form.first_name.data, last_name=form.last_name.data,
                         phone_number=form.phone_number.data, address=form.address.data)
-            user.put()
-            user.id = str(user.key.id())
-            user.put()
+            save(user)
+            response_cache.invalidate('User')
             return redirect(url_for('login'))
         else:
             flash(form.errors)
@@ -92,18 +96,90 @@ def logout():
     return redirect(url_for('index'))
 
 
+@app.route('/admin/migrations/room-keys', methods=['POST'])
+@login_required
+@admin_required
+def migrate_rooms():
+    """
+    re-keys existing rooms by room number
+    :return:
+    """
+    migrated = migrate_room_keys()
+    response_cache.invalidate('Room')
+    return jsonify(migrated=migrated)
+
+
+@app.route('/admin/migrations/customer-search', methods=['POST'])
+@login_required
+@admin_required
+def migrate_customer_search():
+    """
+    builds the search tokens of existing customers
+    :return:
+    """
+    indexed = index_customers()
+    response_cache.invalidate('Customer')
+    return jsonify(indexed=indexed)
+
+
+@app.route('/admin/migrations/change-sequences', methods=['POST'])
+@login_required
+@admin_required
+def migrate_change_sequences():
+    """
+    stamps existing customers, rooms and bookings with a change sequence
+    :return:
+    """
+    stamped = stamp_sequences()
+    response_cache.invalidate('Customer', 'Room', 'Booking')
+    return jsonify(stamped=stamped)
+
+
+SPEC_TEMPLATE = {
+    "info": {
+        "version": "1.0",
+        "title": "Hotel Bookings API",
+    }
+}
+
+# swagger spec body and ETag, built on the first /spec request of the instance
+spec_cache = {}
+
+
+def build_spec():
+    """
+    generates the swagger spec from the handler docstrings, which only change with a deploy
+    :return: JSON body, ETag
+    """
+    body = json.dumps(swagger(app, from_file_keyword='swagger_from_file', template=SPEC_TEMPLATE))
+    return body, hashlib.sha1(body).hexdigest()
+
+
 @app.route("/spec")
 def spec():
-    return jsonify(swagger(app, from_file_keyword='swagger_from_file', template={
-        "info": {
-            "version": "1.0",
-            "title": "Hotel Bookings API",
-        }
-    }))
+    if 'spec' not in spec_cache:
+        spec_cache['spec'] = build_spec()
+    body, etag = spec_cache['spec']
+
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 
 app.api.add_resource(LoginResource, '/login')
 app.api.add_resource(UserResource, '/users', '/users/<string:obj_id>')
 app.api.add_resource(CustomerResource, '/customers', '/customers/<string:obj_id>')
+app.api.add_resource(CustomerBatchResource, '/customers/batch')
+app.api.add_resource(CustomerSearchResource, '/customers/search')
+app.api.add_resource(CustomerChangesResource, '/customers/changes')
 app.api.add_resource(BookingResource, '/bookings', '/bookings/<string:obj_id>')
+app.api.add_resource(BookingBatchResource, '/bookings/batch')
+app.api.add_resource(BookingChangesResource, '/bookings/changes')
 app.api.add_resource(RoomResource, '/rooms', '/rooms/<string:obj_id>')
+app.api.add_resource(RoomBatchResource, '/rooms/batch')
+app.api.add_resource(RoomChangesResource, '/rooms/changes')
+app.api.add_resource(AvailabilityResource, '/rooms/available')
+app.api.add_resource(OccupancyResource, '/rooms/occupancy')
+app.api.add_resource(StatsResource, '/stats')
+app.api.add_resource(DashboardResource, '/dashboard')
+app.api.add_resource(EventsResource, '/events')
@@ -0,0 +1,92 @@
+import logging
+
+from google.appengine.ext import ndb
+
+import counters
+from models import Booking, Customer, Room, Tombstone
+
+
+@ndb.transactional(xg=True)
+def migrate_room(key):
+    """
+    moves a room stored under an allocated id to the key derived from its number
+    :param key: current room key
+    :return: True if the room was migrated
+    """
+    room = key.get()
+    if room is None or room.key == Room.key_for_number(room.number):
+        return False
+
+    new_key = Room.key_for_number(room.number)
+    if new_key.get() is not None:
+        logging.warning('Room with number %s already exists, leaving duplicate %s in place', room.number, key)
+        return False
+
+    Room(key=new_key, id=str(room.number), number=room.number, is_booked=room.is_booked, stays=room.stays,
+         date_created=room.date_created, date_modified=room.date_modified).put()
+    key.delete()
+    ndb.put_multi(Tombstone.for_keys([key]))
+    counters.increment(counters.version(key.kind()))
+    return True
+
+
+def migrate_room_keys(batch_size=100):
+    """
+    re-keys every Room created before rooms were keyed by their number
+    :param batch_size: datastore batch size
+    :return: number of rooms migrated
+    """
+    migrated = 0
+    for room in Room.query().iter(batch_size=batch_size):
+        if room.number is not None and room.key != Room.key_for_number(room.number):
+            migrated += int(migrate_room(room.key))
+
+    return migrated
+
+
+def index_customers(batch_size=100):
+    """
+    writes the search tokens of every Customer created before customers were searchable,
+    Customer._pre_put_hook computes them on put
+    :param batch_size: datastore batch size
+    :return: number of customers indexed
+    """
+    indexed = 0
+    cursor, more = None, True
+    while more:
+        customers, cursor, more = Customer.query().fetch_page(batch_size, start_cursor=cursor)
+        ndb.put_multi(customers)
+        if customers:
+            counters.increment(counters.version(Customer._get_kind()))
+        indexed += len(customers)
+
+    return indexed
+
+
+@ndb.transactional(xg=True)
+def stamp_sequence(keys):
+    """
+    re-puts the entities written before they carried a change sequence, Tracked._pre_put_hook stamps them
+    :param keys: at most 24 keys of one kind
+    :return: number of entities stamped
+    """
+    entities = [entity for entity in ndb.get_multi(keys) if entity is not None and entity.sequence is None]
+    if entities:
+        ndb.put_multi(entities)
+        counters.increment(counters.version(keys[0].kind()))
+    return len(entities)
+
+
+def stamp_sequences(batch_size=20):
+    """
+    gives every customer, room and booking a change sequence so /changes?since=0 returns them
+    :param batch_size: entities per transaction
+    :return: number of entities stamped
+    """
+    stamped = 0
+    for model in (Customer, Room, Booking):
+        keys = model.query().fetch(keys_only=True)
+        for start in range(0, len(keys), batch_size):
+            stamped += stamp_sequence(keys[start:start + batch_size])
+
+    return stamped
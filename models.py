@@ -1,14 +1,151 @@
 import hashlib
+import threading
+import time
 
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
+import events
+import search
+
+# seconds authenticated users stay cached in memcache
+USER_CACHE_TTL = 60
+
+# number of ids reserved per datastore allocation
+ID_BLOCK_SIZE = 100
+
+
+class IdPool(object):
+    """
+    per-instance pool of datastore ids, reserved in blocks with Model.allocate_ids
+    so new entities get complete keys without an extra put
+    """
+
+    def __init__(self, block_size=ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self.blocks = {}
+        self.lock = threading.Lock()
+
+    def next_key(self, model):
+        """
+        returns a complete, unused key for model
+        :param model: ndb model class
+        :return:
+        """
+        with self.lock:
+            start, end = self.blocks.get(model._get_kind(), (1, 0))
+            if start > end:
+                start, end = model.allocate_ids(size=self.block_size)
+            self.blocks[model._get_kind()] = (start + 1, end)
+
+        return ndb.Key(model, start)
+
+
+id_pool = IdPool()
+
+
+def allocate_key(model):
+    """
+    returns a pre-allocated key for a new entity of model
+    :param model: ndb model class
+    :return:
+    """
+    return id_pool.next_key(model)
+
+
+class ChangeSequence(object):
+    """
+    per-instance source of change sequences, microseconds since the epoch,
+    strictly increasing within the instance so writes made together still sort apart
+    """
+
+    def __init__(self):
+        self.last = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        """
+        returns the sequence of a write made now
+        :return:
+        """
+        with self.lock:
+            self.last = max(sequence_at(time.time()), self.last + 1)
+            return self.last
+
+
+def sequence_at(timestamp):
+    """
+    change sequence of a unix timestamp
+    :param timestamp: seconds since the epoch
+    :return:
+    """
+    return int(timestamp * 1000000)
+
+
+change_sequence = ChangeSequence()
+
+
+class Tracked(ndb.Model):
+    """
+    base of the kinds clients sync incrementally, every put stamps the entity with the next change sequence
+    and every delete must write a Tombstone. Committed puts and deletes are published as change events
+    """
+    sequence = ndb.IntegerProperty()
+
+    def _pre_put_hook(self):
+        """
+        stamps the change sequence before every put
+        :return:
+        """
+        self.sequence = change_sequence.next()
+
+    def _post_put_hook(self, future):
+        """
+        publishes the write once its transaction commits, see events.py
+        :param future:
+        :return:
+        """
+        if future.get_exception() is None:
+            ndb.get_context().call_on_commit(lambda: events.publish(self._get_kind(), 'put', entity=self))
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        """
+        publishes the delete once its transaction commits, see events.py
+        :param key:
+        :param future:
+        :return:
+        """
+        if future.get_exception() is None:
+            ndb.get_context().call_on_commit(lambda: events.publish(key.kind(), 'delete', key=key))
+
+
+class Tombstone(ndb.Model):
+    """
+    marks the deletion of a tracked entity, keyed by the deleted entity's kind and id
+    """
+    kind = ndb.StringProperty()
+    entity_key = ndb.KeyProperty(indexed=False)
+    sequence = ndb.IntegerProperty()
+
+    @classmethod
+    def for_keys(cls, keys):
+        """
+        tombstones for the keys of tracked kinds, put them in the transaction deleting the keys
+        :param keys: deleted keys
+        :return: list of tombstone objects
+        """
+        return [cls(id='{}-{}'.format(key.kind(), key.id()), kind=key.kind(), entity_key=key,
+                    sequence=change_sequence.next())
+                for key in keys if issubclass(ndb.Model._kind_map.get(key.kind(), ndb.Model), Tracked)]
+
 
 class Address(ndb.Model):
     """An address model."""
     # date stamp
     id = ndb.TextProperty(indexed=True)
     date_created = ndb.DateProperty(auto_now_add=True)
-    date_modified = ndb.DateProperty(auto_now_add=True)
+    date_modified = ndb.DateProperty(auto_now=True)
 
     # Basic info.
     first_name = ndb.StringProperty()
@@ -25,6 +162,9 @@ class User(ndb.Model):
     """
     User model
     """
+    # entities fetched by key (e.g. load_user) are cached by ndb in memcache with a short ttl
+    _memcache_timeout = USER_CACHE_TTL
+
     id = ndb.TextProperty(indexed=True)
     username = ndb.StringProperty(indexed=True)
     password = ndb.TextProperty(indexed=True)
@@ -36,7 +176,7 @@ class User(ndb.Model):
 
     # date stamp
     date_created = ndb.DateProperty(auto_now_add=True)
-    date_modified = ndb.DateProperty(auto_now_add=True)
+    date_modified = ndb.DateProperty(auto_now=True)
 
     def check_password(self, password):
         """
@@ -46,21 +186,92 @@ class User(ndb.Model):
         """
         return hashlib.md5(password).hexdigest() == self.password
 
+    @staticmethod
+    def username_cache_key(username):
+        """
+        memcache key mapping a username to a user id
+        :param username:
+        :return:
+        """
+        return 'user:username:{}'.format(username)
+
+    @classmethod
+    def get_by_username(cls, username):
+        """
+        looks up a user by username using the cached username to id mapping,
+        falling back to a datastore query on a miss
+        :param username:
+        :return: user object or None
+        """
+        user_id = memcache.get(cls.username_cache_key(username))
+        if user_id is not None:
+            user = cls.get_by_id(user_id)
+            if user and user.username == username:
+                return user
+
+        user = cls.query(cls.username == username).get()
+        if user:
+            memcache.set(cls.username_cache_key(username), user.key.id(), time=USER_CACHE_TTL)
+        return user
+
+    @classmethod
+    def uncache_username(cls, username):
+        """
+        removes the cached username to id mapping, call when a user is deleted
+        :param username:
+        :return:
+        """
+        memcache.delete(cls.username_cache_key(username))
 
-class Room(ndb.Model):
+    def _post_put_hook(self, future):
+        """
+        refreshes the cached username to id mapping after every successful put, once its transaction commits
+        :param future:
+        :return:
+        """
+        if self.username and future.get_exception() is None:
+            cache_key, user_id = self.username_cache_key(self.username), future.get_result().id()
+            ndb.get_context().call_on_commit(lambda: memcache.set(cache_key, user_id, time=USER_CACHE_TTL))
+
+
+class Room(Tracked):
     """
-    room to be booked
+    room to be booked, keyed by its room number
     """
     id = ndb.TextProperty(indexed=True)
     number = ndb.IntegerProperty()
     is_booked = ndb.BooleanProperty()
 
+    # sorted, non-overlapping [check in ordinal, check out ordinal, booking id] stays, see availability.py
+    stays = ndb.JsonProperty()
+    # one bit per night from occupancy_origin (a date ordinal), see occupancy.py
+    occupancy = ndb.BlobProperty()
+    occupancy_origin = ndb.IntegerProperty(indexed=False)
+
     # date stamp
     date_created = ndb.DateProperty(auto_now_add=True)
-    date_modified = ndb.DateProperty(auto_now_add=True)
+    date_modified = ndb.DateProperty(auto_now=True)
+
+    @classmethod
+    def key_for_number(cls, number):
+        """
+        deterministic key of the room with the given number
+        :param number: room number
+        :return:
+        """
+        return ndb.Key(cls, int(number))
+
+    @classmethod
+    def get_by_number(cls, number):
+        """
+        strongly consistent lookup of a room by its number
+        :param number: room number
+        :return: room object or None
+        """
+        return cls.key_for_number(number).get()
 
 
-class Customer(ndb.Model):
+class Customer(Tracked):
     """
     Hotel customer
     """
@@ -70,12 +281,24 @@ class Customer(ndb.Model):
     address = ndb.TextProperty()
     phone_number = ndb.IntegerProperty()
 
+    # name and phone number prefixes, maintained on every put, see search.py
+    search_tokens = ndb.StringProperty(repeated=True)
+
     # date stamp
     date_created = ndb.DateProperty(auto_now_add=True)
-    date_modified = ndb.DateProperty(auto_now_add=True)
+    date_modified = ndb.DateProperty(auto_now=True)
 
+    def _pre_put_hook(self):
+        """
+        refreshes the search tokens before every put
+        :return:
+        """
+        super(Customer, self)._pre_put_hook()
+        self.search_tokens = search.index_tokens(names=(self.first_name, self.last_name),
+                                                 phone_numbers=(self.phone_number,))
 
-class Booking(ndb.Model):
+
+class Booking(Tracked):
     """
     Booking model for storing customer booking records
     """
@@ -84,6 +307,12 @@ class Booking(ndb.Model):
     room_number = ndb.IntegerProperty()
     is_active = ndb.BooleanProperty()
 
+    # stay dates, check_out is exclusive. Bookings without dates hold the room through Room.is_booked
+    check_in = ndb.DateProperty()
+    check_out = ndb.DateProperty()
+    # when the booking was made, unlike sequence it does not change when the booking is written again
+    booked_at = ndb.DateTimeProperty()
+
     # date stamp
     date_created = ndb.DateProperty(auto_now_add=True)
-    date_modified = ndb.DateProperty(auto_now_add=True)
+    date_modified = ndb.DateProperty(auto_now=True)
@@ -0,0 +1,170 @@
+import binascii
+from datetime import date
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# nights held per room: a rolling window of about two years, one bit per night
+WINDOW_BYTES = 92
+WINDOW_NIGHTS = WINDOW_BYTES * 8
+
+
+def window_origin(day=None):
+    """
+    first night of the current window, aligned to 8 nights so bitmaps re-base by whole bytes
+    :param day: defaults to today
+    :return: date ordinal
+    """
+    ordinal = (day or date.today()).toordinal()
+    return ordinal - ordinal % 8
+
+
+def covers(start, end):
+    """
+    checks if the night range [start, end) falls inside the current window
+    :param start: date
+    :param end: date, exclusive
+    :return:
+    """
+    origin = window_origin()
+    return start.toordinal() >= origin and end.toordinal() <= origin + WINDOW_NIGHTS
+
+
+def set_nights(data, origin, start, end, value):
+    """
+    sets or clears the bits for the nights in [start, end) that fall inside the window
+    :param data: bytearray aligned to origin
+    :param origin: window origin ordinal
+    :param start: date
+    :param end: date, exclusive
+    :param value: True to mark nights occupied
+    :return: data
+    """
+    first = max(start.toordinal() - origin, 0)
+    last = min(end.toordinal() - origin, WINDOW_NIGHTS)
+    for night in range(first, last):
+        if value:
+            data[night // 8] |= 0x80 >> (night % 8)
+        else:
+            data[night // 8] &= ~(0x80 >> (night % 8)) & 0xFF
+    return data
+
+
+def bitmap(room, origin):
+    """
+    returns the room's occupancy aligned to origin, rebuilding it from the room's stays when missing
+    and marking the stays of nights the stored bitmap did not cover when the window has moved
+    :param room: room object
+    :param origin: window origin ordinal
+    :return: bytearray of WINDOW_BYTES
+    """
+    if room.occupancy is None or room.occupancy_origin is None:
+        data = bytearray(WINDOW_BYTES)
+        for start, end, booking_id in room.stays or []:
+            set_nights(data, origin, date.fromordinal(start), date.fromordinal(end), True)
+        return data
+
+    shift = (origin - room.occupancy_origin) // 8
+    data = bytearray(room.occupancy)
+    data = data[shift:] if shift >= 0 else bytearray(-shift) + data
+    data = data[:WINDOW_BYTES]
+    data = data + bytearray(WINDOW_BYTES - len(data))
+
+    # nights outside the stored window were never marked, the stays cover them
+    stored_start, stored_end = room.occupancy_origin, room.occupancy_origin + WINDOW_NIGHTS
+    for start, end, booking_id in room.stays or []:
+        for first, last in ((start, min(end, stored_start)), (max(start, stored_end), end)):
+            if first < last:
+                set_nights(data, origin, date.fromordinal(first), date.fromordinal(last), True)
+    return data
+
+
+def held(room, origin):
+    """
+    returns the room's bitmap with every night from today on marked when an undated booking holds the room
+    :param room: room object
+    :param origin: window origin ordinal
+    :return: bytearray of WINDOW_BYTES
+    """
+    data = bitmap(room, origin)
+    if room.is_booked:
+        set_nights(data, origin, date.today(), date.fromordinal(origin + WINDOW_NIGHTS), True)
+    return data
+
+
+def mark(room, start, end, value):
+    """
+    marks the nights in [start, end) occupied or free on the room, re-basing it to the current window
+    :param room: room object, put by the caller
+    :param start: date
+    :param end: date, exclusive
+    :param value: True to mark nights occupied
+    :return:
+    """
+    origin = window_origin()
+    room.occupancy = bytes(set_nights(bitmap(room, origin), origin, start, end, value))
+    room.occupancy_origin = origin
+
+
+def to_int(data):
+    """
+    converts a bitmap to an integer, night 0 being the most significant bit
+    :param data:
+    :return:
+    """
+    return int(binascii.hexlify(bytes(data)) or '0', 16)
+
+
+def matrix(rooms, origin):
+    """
+    stacks the rooms' held nights into a rooms x WINDOW_BYTES uint8 array
+    :param rooms: list of room objects
+    :param origin: window origin ordinal
+    :return:
+    """
+    data = b''.join(bytes(held(room, origin)) for room in rooms)
+    return numpy.frombuffer(data, dtype=numpy.uint8).reshape(len(rooms), WINDOW_BYTES)
+
+
+def free_rooms(rooms, start, end):
+    """
+    returns the rooms with no occupied night in [start, end), the range must be covered by the window
+    :param rooms: list of room objects
+    :param start: date
+    :param end: date, exclusive
+    :return: list of room objects
+    """
+    origin = window_origin()
+    mask = set_nights(bytearray(WINDOW_BYTES), origin, start, end, True)
+
+    if numpy is not None and rooms:
+        busy = numpy.bitwise_and(matrix(rooms, origin), numpy.frombuffer(bytes(mask), dtype=numpy.uint8)).any(axis=1)
+        return [room for room, is_busy in zip(rooms, busy) if not is_busy]
+
+    mask = to_int(mask)
+    return [room for room in rooms if not to_int(held(room, origin)) & mask]
+
+
+def occupancy_by_night(rooms, start, end):
+    """
+    counts occupied rooms for every night in [start, end), the range must be covered by the window
+    :param rooms: list of room objects
+    :param start: date
+    :param end: date, exclusive
+    :return: list of (date, occupied rooms) tuples
+    """
+    origin = window_origin()
+    first, last = start.toordinal() - origin, end.toordinal() - origin
+
+    if numpy is not None and rooms:
+        counts = numpy.unpackbits(matrix(rooms, origin), axis=1)[:, first:last].sum(axis=0).tolist()
+    else:
+        counts = [0] * (last - first)
+        for room in rooms:
+            bits = to_int(held(room, origin))
+            for index in range(last - first):
+                counts[index] += (bits >> (WINDOW_NIGHTS - 1 - first - index)) & 1
+
+    return [(date.fromordinal(origin + first + index), count) for index, count in enumerate(counts)]
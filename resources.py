@@ -1,15 +1,170 @@
-import hashlib, json
+import hashlib, json, operator, time
+from datetime import date, timedelta
+from functools import wraps
 
-from flask import g, request, make_response
-from flask_restful import Resource, abort, fields, marshal
+import six
+
+from flask import g, request, make_response, current_app, Response, stream_with_context
+from flask_restful import Resource, abort, fields, inputs
+from flask_restful.utils import unpack
 from flask_httpauth import HTTPBasicAuth
+from google.appengine.api import datastore_errors, memcache
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
-
-from models import User, Booking, Room, Customer
-from forms import LoginForm, RegistrationForm, BookingForm, RoomForm, CustomerForm, UpdateForm, UpdateBookingForm
-from services import is_json, CustomException
+from Queue import Empty
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date, is_resource_modified, quote_etag
+from werkzeug.utils import import_string
+
+import availability
+import bookings
+import counters
+import events
+import occupancy
+import search
+from models import User, Booking, Room, Customer, Tombstone, allocate_key, sequence_at
+from forms import LoginForm, RegistrationForm, BookingForm, RoomForm, CustomerForm, UpdateForm, UpdateBookingForm, \
+    UpdateRoomForm
+from services import is_json, is_true, CustomException, CredentialCache, Marshaller, ResponseCache, \
+    admin_required
+from settings import Config
+
+# entities written per batch transaction, cross-group transactions are limited to 25 entity groups
+BATCH_CHUNK_SIZE = 20
 
 auth = HTTPBasicAuth()
+credential_cache = CredentialCache(Config.SECRET_KEY, max_size=Config.CREDENTIAL_CACHE_SIZE,
+                                   ttl=Config.CREDENTIAL_CACHE_TTL)
+response_cache = ResponseCache(import_string(Config.RESPONSE_CACHE)(**Config.RESPONSE_CACHE_OPTIONS))
+
+
+@ndb.transactional_tasklet(xg=True)
+def save_async(*entities, **deltas):
+    """
+    puts entities and applies counter deltas in a single transaction, issuing the writes concurrently
+    :param entities: model objects with complete keys (see models.allocate_key)
+    :param deltas: counter name to delta, the version of every written kind is bumped as well
+    :return: future
+    """
+    for entity in entities:
+        if not entity.id:
+            entity.id = str(entity.key.id())
+        deltas[counters.version(entity.key.kind())] = 1
+
+    futures = ndb.put_multi_async(entities)
+    futures.extend(counters.increment_async(name, delta) for name, delta in deltas.items() if delta)
+    yield futures
+
+
+def save(*entities, **deltas):
+    """
+    synchronous save_async
+    :param entities: model objects with complete keys (see models.allocate_key)
+    :param deltas: counter name to delta
+    :return:
+    """
+    save_async(*entities, **deltas).get_result()
+
+
+class EntityExists(Exception):
+    """
+    raised when a new entity's key is already taken
+    """
+    def __init__(self, keys):
+        super(EntityExists, self).__init__('Key(s) already taken: {}'.format(keys))
+        self.keys = keys
+
+
+@ndb.transactional_tasklet(xg=True)
+def create_async(new, *entities, **deltas):
+    """
+    save_async that first checks, in the same transaction, that the keys of the new entities are free.
+    Entities keyed by a natural id, e.g. rooms by number, cannot be overwritten by a concurrent create
+    :param new: list of new model objects
+    :param entities: other model objects to put
+    :param deltas: counter name to delta
+    :return: future
+    :raises EntityExists: if any key of new is taken
+    """
+    found = yield ndb.get_multi_async([entity.key for entity in new])
+    taken = [entity.key for entity, existing in zip(new, found) if existing is not None]
+    if taken:
+        raise EntityExists(taken)
+    yield save_async(*(list(new) + list(entities)), **deltas)
+
+
+def create(new, *entities, **deltas):
+    """
+    synchronous create_async
+    :param new: list of new model objects
+    :param entities: other model objects to put
+    :param deltas: counter name to delta
+    :return:
+    """
+    create_async(new, *entities, **deltas).get_result()
+
+
+@ndb.transactional_tasklet(xg=True)
+def remove_async(*keys, **deltas):
+    """
+    deletes entities, writes their tombstones and applies counter deltas in a single transaction,
+    issuing the writes concurrently
+    :param keys: keys to delete
+    :param deltas: counter name to delta, the version of every written kind is bumped as well
+    :return: future
+    """
+    for key in keys:
+        deltas[counters.version(key.kind())] = 1
+
+    futures = ndb.delete_multi_async(keys)
+    futures.extend(ndb.put_multi_async(Tombstone.for_keys(keys)))
+    futures.extend(counters.increment_async(name, delta) for name, delta in deltas.items() if delta)
+    yield futures
+
+
+def remove(*keys, **deltas):
+    """
+    synchronous remove_async
+    :param keys: keys to delete
+    :param deltas: counter name to delta
+    :return:
+    """
+    remove_async(*keys, **deltas).get_result()
+
+
+def conditional(*kinds):
+    """
+    conditional GET for a resource method. The ETag and Last-Modified headers derive from the versions of the
+    kinds the response is built from, so a matching If-None-Match is answered with a 304 before anything is fetched.
+    If-Modified-Since is not, Last-Modified has a one second resolution and misses writes within the same second
+    :param kinds: datastore kinds whose writes change the response
+    :return:
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            versions, last_modified = counters.get_versions(kinds)
+            etag = u'{} {}'.format(request.full_path, sorted(versions.items()))
+            etag = hashlib.sha1(etag.encode('utf-8')).hexdigest()
+            headers = {'ETag': quote_etag(etag), 'Cache-Control': 'no-cache'}
+            if last_modified:
+                headers['Last-Modified'] = http_date(last_modified)
+
+            if not is_resource_modified(request.environ, etag=etag):
+                return Response(status=304, headers=headers)
+
+            resp = func(*args, **kwargs)
+            if isinstance(resp, Response):
+                if resp.status_code == 200:
+                    resp.headers.extend(headers)
+                return resp
+
+            data, code, resp_headers = unpack(resp)
+            if code == 200:
+                resp_headers = dict(resp_headers or {}, **headers)
+            return data, code, resp_headers
+        return wrapper
+    return decorator
 
 
 @auth.verify_password
@@ -20,9 +175,9 @@ def verify_password(username, password):
     :param password:
     :return:
     """
-    user = User.query(User.username == username).get()
+    user = User.get_by_username(username)
 
-    if not user or not user.check_password(password):
+    if not user or not credential_cache.verify(user, password):
         try:
             if g.user:
                 return True
@@ -33,17 +188,27 @@ def verify_password(username, password):
 
 
 class BaseResource(Resource):
-    @property
-    def output_fields(self):
-        """
-        default fields present in all model objects
-        :return:
-        """
-        return {
-            'id': fields.Integer,
-            'date_created': fields.DateTime(dt_format='iso8601'),
-            'date_modified': fields.DateTime(dt_format='iso8601')
-        }
+    # default fields present in all model objects
+    output_fields = {
+        'id': fields.Integer,
+        'date_created': fields.DateTime(dt_format='iso8601'),
+        'date_modified': fields.DateTime(dt_format='iso8601')
+    }
+    # indexed properties every entity has, which can be loaded alone with a projection query
+    projectable = ('date_created', 'date_modified')
+    # property sets with a composite index in index.yaml, which can be loaded together with a projection query
+    projections = ()
+    # marshallers for field subsets, keyed by resource and fields
+    partial_marshallers = {}
+    # properties filterable by equality, keyed by request argument with the value parser
+    filters = {}
+    # date properties filterable by range with the <name>_from (inclusive) and <name>_to (exclusive) arguments
+    range_filters = ()
+    # properties accepted by order_by, prefixed with - for descending order
+    orderable = ()
+    # (equality properties, sort order) pairs with a composite index in index.yaml,
+    # equality filters alone and a single range or sort without equality filters use the built-in indexes
+    indexes = ()
 
     def prepare_errors(self, errors):
         """
@@ -69,6 +234,344 @@ class BaseResource(Resource):
 
         return data
 
+    def prepare_batch(self):
+        """
+        processes a batch request body, a JSON array of objects
+        :return: list of item data
+        """
+        items = json.loads(request.data) if is_json(request.data) else None
+        if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+            raise CustomException(code=400, name='Validation Failed',
+                                  data={"description": 'Request body must be a JSON array of objects'})
+
+        if len(items) > current_app.config['MAX_BATCH_SIZE']:
+            raise CustomException(code=400, name='Validation Failed',
+                                  data={"description": 'Batches are limited to {} items'.format(
+                                      current_app.config['MAX_BATCH_SIZE'])})
+        return items
+
+    def save_batch(self, items, model, build):
+        """
+        validates every item of a batch request and writes the valid ones with put_multi,
+        BATCH_CHUNK_SIZE entities and their counter deltas per transaction
+        :param items: item data from prepare_batch
+        :param model: ndb model, items with an 'id' update the existing entity
+        :param build: function(data, entity) returning the entity to put and its counter deltas
+        :return: per-item results in request order
+        """
+        keys = [ndb.Key(model, int(item['id'])) if str(item.get('id', '')).isdigit() else None for item in items]
+        existing = [key for key in keys if key]
+        existing = dict(zip(existing, ndb.get_multi(existing)))
+
+        results, pending, seen = [], [], set()
+        for index, item in enumerate(items):
+            key = keys[index]
+            if item.get('id') and existing.get(key) is None:
+                results.append({'status': 404, 'errors': {'id': ['{} with key ({}) not found'.format(
+                    model.__name__, item['id'])]}})
+                continue
+
+            try:
+                entity, deltas = build(MultiDict(item), existing.get(key))
+            except CustomException as e:
+                results.append({'status': 400, 'errors': e.data})
+                continue
+
+            if entity.key in seen:
+                results.append({'status': 400, 'errors': {'id': ['Duplicate of an earlier item in this batch']}})
+                continue
+            seen.add(entity.key)
+            results.append(None)
+            pending.append((index, entity, deltas, 200 if key else 201))
+
+        for start in range(0, len(pending), BATCH_CHUNK_SIZE):
+            chunk = pending[start:start + BATCH_CHUNK_SIZE]
+            totals = {}
+            for index, entity, deltas, status in chunk:
+                for name, delta in deltas.items():
+                    totals[name] = totals.get(name, 0) + delta
+
+            try:
+                create([entity for index, entity, deltas, status in chunk if status == 201],
+                       *[entity for index, entity, deltas, status in chunk if status != 201], **totals)
+            except EntityExists as e:
+                for index, entity, deltas, status in chunk:
+                    results[index] = {'status': 409, 'errors': {'id': [
+                        '{} with key ({}) already exists'.format(model.__name__, entity.key.id())
+                        if entity.key in e.keys else 'Write failed, try again']}}
+                continue
+            except datastore_errors.TransactionFailedError:
+                for index, entity, deltas, status in chunk:
+                    results[index] = {'status': 409, 'errors': {'description': ['Write failed, try again']}}
+                continue
+
+            for index, entity, deltas, status in chunk:
+                results[index] = {'status': status, 'result': self.marshaller(entity)}
+
+        return results
+
+    def get_by_ids(self, model, ids):
+        """
+        resolves comma separated ids with a single get_multi, reporting missing ids inline
+        :param model: ndb model
+        :param ids: comma separated ids
+        :return: response data with results in request order
+        """
+        ids = [obj_id.strip() for obj_id in ids.split(',') if obj_id.strip()]
+        if len(ids) > current_app.config['MAX_PAGE_SIZE']:
+            abort(400, message="At most {} ids can be requested at once".format(current_app.config['MAX_PAGE_SIZE']))
+
+        keys = [ndb.Key(model, int(obj_id)) if obj_id.isdigit() else None for obj_id in ids]
+        entities = iter(ndb.get_multi([key for key in keys if key]))
+
+        results, count = [], 0
+        for obj_id, key in zip(ids, keys):
+            entity = next(entities) if key else None
+            if entity is None:
+                results.append({'id': obj_id, 'error': '{} with key ({}) not found'.format(model.__name__, obj_id)})
+                continue
+            results.append(self.marshaller(entity))
+            count += 1
+
+        return {'results': results, 'count': count}
+
+    def parse_filters(self, model):
+        """
+        reads the filter, <name>_from, <name>_to and order_by request arguments,
+        rejecting combinations the datastore has no index for
+        :param model: ndb model
+        :return: list of filter nodes, list of orders
+        """
+        filters, equality = [], []
+        for name, parse in sorted(self.filters.items()):
+            if name in request.args:
+                try:
+                    value = parse(request.args[name])
+                except ValueError:
+                    abort(400, message="Invalid value for {} ({})".format(name, request.args[name]))
+                filters.append(model._properties[name] == value)
+                equality.append(name)
+
+        inequality = None
+        for name in self.range_filters:
+            for suffix, compare in (('_from', operator.ge), ('_to', operator.lt)):
+                arg = name + suffix
+                if arg not in request.args:
+                    continue
+                try:
+                    value = inputs.date(request.args[arg]).date()
+                except ValueError:
+                    abort(400, message="{} must be a date in YYYY-MM-DD format".format(arg))
+                if inequality not in (None, name):
+                    abort(400, message="Only one of {} can be filtered by range".format(', '.join(self.range_filters)))
+                filters.append(compare(model._properties[name], value))
+                inequality = name
+
+        orders, sort = [], inequality
+        order_by = request.args.get('order_by', '').strip()
+        if order_by:
+            name = order_by.lstrip('-')
+            if name not in self.orderable:
+                abort(400, message="order_by must be one of {}".format(', '.join(self.orderable) or 'nothing'))
+            if inequality and name != inequality:
+                abort(400, message="order_by must be {} when filtering by its range".format(inequality))
+            if name not in equality:
+                prop = model._properties[name]
+                orders.append(-prop if order_by.startswith('-') else prop)
+                sort = order_by
+
+        if equality and sort and (tuple(equality), sort) not in self.indexes:
+            abort(400, message="Filtering by {} ordered by {} is not supported".format(', '.join(equality), sort))
+        return filters, orders
+
+    def count_async(self, model, counter, filters):
+        """
+        counts the collection, from the sharded counter when unfiltered
+        :param model: ndb model
+        :param counter: counter name
+        :param filters: filter nodes from parse_filters
+        :return: future of the count
+        """
+        if filters:
+            return model.query(*filters).count_async()
+        return counters.get_count_async(counter)
+
+    def select(self, model, filters=(), orders=()):
+        """
+        builds the collection query and marshalling function for the 'fields' request argument.
+        Only ids become a keys-only query, indexed field sets become a projection query
+        and other field sets load full entities but marshal only the requested fields.
+        Filtered or ordered queries are never projected, their composite indexes do not cover the projections
+        :param model: ndb model
+        :param filters: filter nodes from parse_filters
+        :param orders: orders from parse_filters
+        :return: query, function marshalling a list of query results
+        """
+        names = [name.strip() for name in request.args.get('fields', '').split(',') if name.strip()]
+        if not names:
+            return model.query(*filters).order(*orders), self.marshaller
+
+        unknown = set(names) - set(self.marshaller.fields)
+        if unknown:
+            abort(400, message="Unknown field(s): {}".format(', '.join(sorted(unknown))))
+
+        properties = tuple(sorted(set(name for name in names if name != 'id')))
+        if not properties:
+            query = model.query(*filters, default_options=ndb.QueryOptions(keys_only=True))
+        elif filters or orders:
+            query = model.query(*filters)
+        elif (len(properties) == 1 and properties[0] in self.projectable) or properties in self.projections:
+            query = model.query(projection=properties)
+        else:
+            query = model.query()
+        query = query.order(*orders)
+
+        cache_key = (type(self).__name__, properties)
+        if cache_key not in self.partial_marshallers:
+            self.partial_marshallers[cache_key] = Marshaller(
+                dict((name, self.marshaller.fields[name]) for name in properties))
+        marshaller = self.partial_marshallers[cache_key]
+
+        def output(results):
+            rows = []
+            for result in results:
+                key = result if isinstance(result, ndb.Key) else result.key
+                row = marshaller(result) if properties else {}
+                if 'id' in names:
+                    # projected entities only carry the projected properties, the id always matches the key
+                    row['id'] = key.id()
+                rows.append(row)
+            return rows
+
+        return query, output
+
+    def parse_limit(self):
+        """
+        reads the 'limit' request argument, capped at MAX_PAGE_SIZE
+        :return: page size
+        """
+        try:
+            limit = int(request.args.get('limit', current_app.config['PAGE_SIZE']))
+        except ValueError:
+            abort(400, message="limit must be an integer")
+
+        if limit < 1:
+            abort(400, message="limit must be greater than zero")
+        return min(limit, current_app.config['MAX_PAGE_SIZE'])
+
+    def paginate(self, query):
+        """
+        fetches a single page of query results using the 'limit' and 'cursor' request arguments
+        :param query: ndb query
+        :return: list of results, urlsafe cursor for the next page or None
+        """
+        limit = self.parse_limit()
+        try:
+            cursor = request.args.get('cursor')
+            start_cursor = Cursor(urlsafe=cursor) if cursor else None
+            results, next_cursor, more = query.fetch_page(limit, start_cursor=start_cursor)
+        except (datastore_errors.BadValueError, datastore_errors.BadRequestError):
+            abort(400, message="Invalid cursor ({})".format(request.args.get('cursor')))
+
+        return results, next_cursor.urlsafe() if more and next_cursor else None
+
+    def changes(self, model):
+        """
+        returns the writes and deletes of a tracked kind after the 'since' change sequence, in sequence order.
+        Changes younger than SYNC_SETTLE_SECONDS are held back until their transactions have committed
+        and the indexes caught up, so a client resuming from next_since never skips one
+        :param model: ndb model extending models.Tracked
+        :return: response data
+        """
+        try:
+            since = int(request.args.get('since', 0))
+        except ValueError:
+            abort(400, message="since must be a next_since value returned by a previous call, or 0")
+
+        limit = self.parse_limit()
+        horizon = sequence_at(time.time() - current_app.config['SYNC_SETTLE_SECONDS'])
+
+        written = model.query(model.sequence > since, model.sequence <= horizon).order(model.sequence)
+        deleted = Tombstone.query(Tombstone.kind == model._get_kind(), Tombstone.sequence > since,
+                                  Tombstone.sequence <= horizon).order(Tombstone.sequence)
+        written, deleted = written.fetch_async(limit + 1), deleted.fetch_async(limit + 1)
+        changes = sorted(written.get_result() + deleted.get_result(), key=lambda entity: entity.sequence)
+
+        more = len(changes) > limit
+        page = changes[:limit]
+        if more and changes[limit].sequence == page[-1].sequence:
+            # sequences are only unique per instance, so writes sharing the last one must not straddle two pages:
+            # the next call resumes after it. They move to the next page, or make up this one if nothing else fits
+            boundary = page[-1].sequence
+            page = [entity for entity in page if entity.sequence != boundary]
+            if not page:
+                page = model.query(model.sequence == boundary).fetch() + Tombstone.query(
+                    Tombstone.kind == model._get_kind(), Tombstone.sequence == boundary).fetch()
+
+        results = []
+        for entity in page:
+            if isinstance(entity, Tombstone):
+                results.append({'id': entity.entity_key.id(), 'sequence': entity.sequence, 'deleted': True,
+                                'data': None})
+            else:
+                results.append({'id': entity.key.id(), 'sequence': entity.sequence, 'deleted': False,
+                                'data': self.marshaller(entity)})
+
+        return {
+            'results': results,
+            'next_since': results[-1]['sequence'] if more else max(horizon, since),
+            'more': more
+        }
+
+    def parse_date_range(self):
+        """
+        reads the 'start' and 'end' YYYY-MM-DD dates from the request arguments
+        :return: start date, end date
+        """
+        try:
+            start, end = inputs.date(request.args['start']).date(), inputs.date(request.args['end']).date()
+        except (KeyError, ValueError):
+            abort(400, message="start and end must be dates in YYYY-MM-DD format")
+
+        if end <= start:
+            abort(400, message="end must be after start")
+        return start, end
+
+    def stream(self, query):
+        """
+        streams up to STREAM_MAX_RESULTS query results as a JSON response, reading one batch at a time.
+        The runtime buffers the whole response body, so the export is paged: pass next_cursor back as 'cursor'
+        :param query: ndb query
+        :return: streaming response with the {"results": [...], "count": n, "next_cursor": ...} envelope
+        """
+        batch_size = current_app.config['STREAM_BATCH_SIZE']
+        max_results = current_app.config['STREAM_MAX_RESULTS']
+        marshaller = self.marshaller
+        try:
+            cursor = request.args.get('cursor')
+            start_cursor = Cursor(urlsafe=cursor) if cursor else None
+        except Exception:
+            abort(400, message="Invalid cursor ({})".format(request.args.get('cursor')))
+
+        def generate():
+            yield '{"results": ['
+            count = 0
+            batch = []
+            results = query.iter(batch_size=batch_size, start_cursor=start_cursor, produce_cursors=True)
+            while count + len(batch) < max_results and results.has_next():
+                batch.append(json.dumps(marshaller(results.next())))
+                if len(batch) == batch_size:
+                    yield (', ' if count else '') + ', '.join(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                yield (', ' if count else '') + ', '.join(batch)
+                count += len(batch)
+            next_cursor = results.cursor_after().urlsafe() if count and results.has_next() else None
+            yield '], "count": %d, "next_cursor": %s}' % (count, json.dumps(next_cursor))
+
+        return Response(stream_with_context(generate()), mimetype='application/json')
+
     def get(self):
         """
         GET request method
@@ -130,6 +633,7 @@ class LoginResource(BaseResource):
         'phone_number': fields.String,
         'username': fields.String
     }
+    marshaller = Marshaller(BaseResource.output_fields, resource_fields)
 
     def post(self):
         """
@@ -160,12 +664,10 @@ class LoginResource(BaseResource):
         form = LoginForm(data, csrf_enabled=False)
 
         if form.validate():
-            user = User.query(User.username == form.username.data).get()
+            user = User.get_by_username(form.username.data)
             if user and user.check_password(form.password.data):
                 g.user = user
-                output = self.output_fields
-                output.update(self.resource_fields)
-                return marshal(user, output), 200
+                return self.marshaller(user), 200
             else:
                 raise CustomException(code=400, description="The provided user credentials are invalid.",
                                       name='Validation Failed',
@@ -199,8 +701,13 @@ class UserResource(BaseResource):
         'address': fields.String,
         'phone_number': fields.String
     }
+    marshaller = Marshaller(BaseResource.output_fields, resource_fields)
+    projectable = ('date_created', 'date_modified', 'username', 'first_name', 'last_name', 'phone_number')
+    projections = (('first_name', 'last_name', 'username'),)
 
     @auth.login_required
+    @response_cache.cached(60, 'User')
+    @conditional('User')
     def get(self, obj_id=None):
         """
         Gets user(s).
@@ -211,6 +718,26 @@ class UserResource(BaseResource):
         parameters:
           - in: path
             name: obj_id
+          - in: query
+            name: ids
+            type: string
+            description: comma separated user ids to fetch in one call, missing ids are reported inline
+          - in: query
+            name: limit
+            type: integer
+            description: maximum number of results per page
+          - in: query
+            name: cursor
+            type: string
+            description: next_cursor value returned by the previous page
+          - in: query
+            name: fields
+            type: string
+            description: comma separated fields to return, loaded with a keys-only or projection query when possible
+          - in: query
+            name: stream
+            type: boolean
+            description: stream up to STREAM_MAX_RESULTS users in large batches, continue from next_cursor
         definitions:
           - schema:
               id: User
@@ -243,12 +770,18 @@ class UserResource(BaseResource):
             $ref: '#/definitions/User'
         """
         if not obj_id:
-            query = User.query().fetch()
-            output = self.output_fields
-            output.update(self.resource_fields)
+            if request.args.get('ids'):
+                return self.get_by_ids(User, request.args['ids']), 200
+
+            if is_true(request.args.get('stream')):
+                return self.stream(User.query())
+
+            query, marshal = self.select(User)
+            results, next_cursor = self.paginate(query)
 
             resp = {
-                'results': marshal(query, output)
+                'results': marshal(results),
+                'next_cursor': next_cursor
             }
 
             return resp, 200
@@ -259,13 +792,12 @@ class UserResource(BaseResource):
             if not user:
                 abort(404, message="User with key ({}) not found".format(obj_id))
 
-            output = self.output_fields
-            output.update(self.resource_fields)
-            return marshal(user, output), 200
+            return self.marshaller(user), 200
         except Exception:
             abort(404, message="User with key ({}) not found".format(obj_id))
 
     @auth.login_required
+    @response_cache.invalidates('User')
     def post(self, obj_id=None):
         """
         Post user(s)
@@ -323,28 +855,24 @@ class UserResource(BaseResource):
                 user.last_name = form.last_name.data if form.last_name.data else user.last_name
                 user.phone_number = int(form.phone_number.data) if form.phone_number.data else user.phone_number
                 user.address = form.address.data if form.address.data else user.address
-                user.put()
-                output = self.output_fields
-                output.update(self.resource_fields)
-                return marshal(user, output), 200
+                save(user)
+                return self.marshaller(user), 200
 
         else:
             form = RegistrationForm(data, csrf_enabled=False)
             if form.validate():
-                user = User(username=form.username.data, password=hashlib.md5(form.password.data).hexdigest(),
+                user = User(key=allocate_key(User), username=form.username.data,
+                            password=hashlib.md5(form.password.data).hexdigest(),
                             first_name=form.first_name.data, last_name=form.last_name.data,
                             phone_number=int(form.phone_number.data), address=form.address.data)
-                user.put()
-                user.id = str(user.key.id())
-                user.put()
-                output = self.output_fields
-                output.update(self.resource_fields)
-                return marshal(user, output), 201
+                save(user)
+                return self.marshaller(user), 201
 
         error_data = self.prepare_errors(form.errors)
         raise CustomException(code=400, name='Validation Failed', data=error_data)
 
     @auth.login_required
+    @response_cache.invalidates('User')
     def delete(self, obj_id):
         """
         DELETE user
@@ -363,7 +891,9 @@ class UserResource(BaseResource):
         """
         try:
             user = User.get_by_id(int(obj_id))
-            user.key.delete()
+            remove(user.key)
+            User.uncache_username(user.username)
+            credential_cache.invalidate(user.username)
             return {"status": "successfully deleted"}, 204
         except Exception:
             raise CustomException(code=400, name='Validation Failed',
@@ -379,8 +909,15 @@ class CustomerResource(BaseResource):
         'address': fields.String,
         'phone_number': fields.String
     }
+    marshaller = Marshaller(BaseResource.output_fields, resource_fields)
+    projectable = ('date_created', 'date_modified', 'first_name', 'last_name', 'phone_number')
+    projections = (('first_name', 'last_name'), ('first_name', 'last_name', 'phone_number'))
+    range_filters = ('date_created',)
+    orderable = ('first_name', 'last_name', 'date_created')
 
     @auth.login_required
+    @response_cache.cached(60, 'Customer')
+    @conditional('Customer')
     def get(self, obj_id=None):
         """
         Gets customer(s).
@@ -391,6 +928,42 @@ class CustomerResource(BaseResource):
         parameters:
           - in: path
             name: obj_id
+          - in: query
+            name: ids
+            type: string
+            description: comma separated customer ids to fetch in one call, missing ids are reported inline
+          - in: query
+            name: limit
+            type: integer
+            description: maximum number of results per page
+          - in: query
+            name: cursor
+            type: string
+            description: next_cursor value returned by the previous page
+          - in: query
+            name: fields
+            type: string
+            description: comma separated fields to return, loaded with a keys-only or projection query when possible
+          - in: query
+            name: stream
+            type: boolean
+            description: stream up to STREAM_MAX_RESULTS customers in large batches, continue from next_cursor
+          - in: query
+            name: count_only
+            type: boolean
+            description: return only the total number of customers
+          - in: query
+            name: date_created_from
+            type: string
+            description: only return customers with date_created on or after this YYYY-MM-DD date
+          - in: query
+            name: date_created_to
+            type: string
+            description: only return customers with date_created before this YYYY-MM-DD date
+          - in: query
+            name: order_by
+            type: string
+            description: one of first_name, last_name, date_created, prefixed with - for descending order
         definitions:
           - schema:
               id: Customer
@@ -419,13 +992,25 @@ class CustomerResource(BaseResource):
             $ref: '#/definitions/Customer'
         """
         if not obj_id:
-            query = Customer.query().fetch()
-            output = self.output_fields
-            output.update(self.resource_fields)
+            if request.args.get('ids'):
+                return self.get_by_ids(Customer, request.args['ids']), 200
+
+            filters, orders = self.parse_filters(Customer)
+            if is_true(request.args.get('count_only')):
+                return {'count': self.count_async(Customer, counters.CUSTOMERS, filters).get_result()}, 200
+
+            if is_true(request.args.get('stream')):
+                return self.stream(Customer.query(*filters).order(*orders))
+
+            # the count overlaps the page fetch
+            count = self.count_async(Customer, counters.CUSTOMERS, filters)
+            query, marshal = self.select(Customer, filters, orders)
+            results, next_cursor = self.paginate(query)
 
             resp = {
-                'results': marshal(query, output),
-                'count': len(query)
+                'results': marshal(results),
+                'count': count.get_result(),
+                'next_cursor': next_cursor
             }
 
             return resp, 200
@@ -436,13 +1021,12 @@ class CustomerResource(BaseResource):
             if not customer:
                 abort(404, message="Customer with key ({}) not found".format(obj_id))
 
-            output = self.output_fields
-            output.update(self.resource_fields)
-            return marshal(customer, output), 200
+            return self.marshaller(customer), 200
         except Exception:
             abort(404, message="Customer with key ({}) not found".format(obj_id))
 
     @auth.login_required
+    @response_cache.invalidates('Customer')
     def post(self, obj_id=None):
         """
        Post customer(s)
@@ -481,42 +1065,45 @@ class CustomerResource(BaseResource):
            description: Customer created
        """
         data = self.prepare_data()
+        customer = None
         if obj_id:
+            customer = Customer.get_by_id(int(obj_id))
+            if not customer:
+                abort(404, message="Customer with key ({}) not found".format(obj_id))
+
+        customer, deltas = self.build(data, customer)
+        save(customer, **deltas)
+        return self.marshaller(customer), 200 if obj_id else 201
+
+    def build(self, data, customer=None):
+        """
+        validates request data and applies it to an existing customer or a new one
+        :param data: request data
+        :param customer: customer to update, None to create one
+        :return: customer, counter deltas
+        """
+        if customer:
             form = UpdateForm(data, csrf_enabled=False)
-            if form.validate():
-                customer = Customer.get_by_id(int(obj_id))
-                if not customer:
-                    abort(404, message="Customer with key ({}) not found".format(obj_id))
-
-                customer.first_name = form.first_name.data if form.first_name.data else customer.first_name
-                customer.last_name = form.last_name.data if form.last_name.data else customer.last_name
-                customer.phone_number = form.phone_number.data if form.phone_number.data else customer.phone_number
-                customer.address = form.address.data if form.address.data else customer.address
-                customer.put()
-
-                output = self.output_fields
-                output.update(self.resource_fields)
-                return marshal(customer, output), 200
-            else:
-                error_data = self.prepare_errors(form.errors)
-                raise CustomException(code=400, name='Validation Failed', data=error_data)
-        else:
-            form = CustomerForm(data, csrf_enabled=False)
+            if not form.validate():
+                raise CustomException(code=400, name='Validation Failed', data=self.prepare_errors(form.errors))
 
-            if form.validate():
-                customer = Customer(first_name=form.first_name.data, last_name=form.last_name.data,
-                                phone_number=form.phone_number.data, address=form.address.data)
-                customer.put()
-                customer.id = str(customer.key.id())
-                customer.put()
-                output = self.output_fields
-                output.update(self.resource_fields)
-                return marshal(customer, output), 201
+            customer.first_name = form.first_name.data if form.first_name.data else customer.first_name
+            customer.last_name = form.last_name.data if form.last_name.data else customer.last_name
+            customer.phone_number = form.phone_number.data if form.phone_number.data else customer.phone_number
+            customer.address = form.address.data if form.address.data else customer.address
+            return customer, {}
 
-        error_data = self.prepare_errors(form.errors)
-        raise CustomException(code=400, name='Validation Failed', data=error_data)
+        form = CustomerForm(data, csrf_enabled=False)
+        if not form.validate():
+            raise CustomException(code=400, name='Validation Failed', data=self.prepare_errors(form.errors))
+
+        customer = Customer(key=allocate_key(Customer), first_name=form.first_name.data,
+                            last_name=form.last_name.data, phone_number=form.phone_number.data,
+                            address=form.address.data)
+        return customer, {counters.CUSTOMERS: 1}
 
     @auth.login_required
+    @response_cache.invalidates('Customer')
     def delete(self, obj_id):
         """
         DELETE Customer
@@ -535,7 +1122,7 @@ class CustomerResource(BaseResource):
         """
         try:
             customer = Customer.get_by_id(int(obj_id))
-            customer.key.delete()
+            remove(customer.key, **{counters.CUSTOMERS: -1})
             return True, 204
         except Exception:
             raise CustomException(code=400, name='Validation Failed',
@@ -548,8 +1135,17 @@ class RoomResource(BaseResource):
         'number': fields.String,
         'is_booked': fields.Boolean
     }
+    marshaller = Marshaller(BaseResource.output_fields, resource_fields)
+    projectable = ('date_created', 'date_modified', 'number', 'is_booked')
+    projections = (('is_booked', 'number'),)
+    filters = {'is_booked': inputs.boolean}
+    range_filters = ('date_created',)
+    orderable = ('number', 'date_created')
+    indexes = ((('is_booked',), 'number'), (('is_booked',), 'date_created'), (('is_booked',), '-date_created'))
 
     @auth.login_required
+    @response_cache.cached(60, 'Room')
+    @conditional('Room')
     def get(self, obj_id=None):
         """
         Gets room(s).
@@ -560,6 +1156,46 @@ class RoomResource(BaseResource):
         parameters:
           - in: path
             name: obj_id
+          - in: query
+            name: ids
+            type: string
+            description: comma separated room ids to fetch in one call, missing ids are reported inline
+          - in: query
+            name: limit
+            type: integer
+            description: maximum number of results per page
+          - in: query
+            name: cursor
+            type: string
+            description: next_cursor value returned by the previous page
+          - in: query
+            name: fields
+            type: string
+            description: comma separated fields to return, loaded with a keys-only or projection query when possible
+          - in: query
+            name: stream
+            type: boolean
+            description: stream up to STREAM_MAX_RESULTS rooms in large batches, continue from next_cursor
+          - in: query
+            name: count_only
+            type: boolean
+            description: return only the total number of rooms
+          - in: query
+            name: is_booked
+            type: boolean
+            description: only return booked or free rooms
+          - in: query
+            name: date_created_from
+            type: string
+            description: only return rooms with date_created on or after this YYYY-MM-DD date
+          - in: query
+            name: date_created_to
+            type: string
+            description: only return rooms with date_created before this YYYY-MM-DD date
+          - in: query
+            name: order_by
+            type: string
+            description: one of number, date_created, prefixed with - for descending order
         definitions:
           - schema:
               id: Room
@@ -577,13 +1213,25 @@ class RoomResource(BaseResource):
             $ref: '#/definitions/Room'
         """
         if not obj_id:
-            query = Room.query().fetch()
-            output = self.output_fields
-            output.update(self.resource_fields)
+            if request.args.get('ids'):
+                return self.get_by_ids(Room, request.args['ids']), 200
+
+            filters, orders = self.parse_filters(Room)
+            if is_true(request.args.get('count_only')):
+                return {'count': self.count_async(Room, counters.ROOMS, filters).get_result()}, 200
+
+            if is_true(request.args.get('stream')):
+                return self.stream(Room.query(*filters).order(*orders))
+
+            # the count overlaps the page fetch
+            count = self.count_async(Room, counters.ROOMS, filters)
+            query, marshal = self.select(Room, filters, orders)
+            results, next_cursor = self.paginate(query)
 
             resp = {
-                'results': marshal(query, output),
-                'count': len(query)
+                'results': marshal(results),
+                'count': count.get_result(),
+                'next_cursor': next_cursor
             }
 
             return resp, 200
@@ -594,13 +1242,12 @@ class RoomResource(BaseResource):
             if not room:
                 abort(404, message="Room with key ({}) not found".format(obj_id))
 
-            output = self.output_fields
-            output.update(self.resource_fields)
-            return marshal(room, output), 200
+            return self.marshaller(room), 200
         except Exception:
             abort(404, message="Room with key ({}) not found".format(obj_id))
 
     @auth.login_required
+    @response_cache.invalidates('Room')
     def post(self, obj_id=None):
         """
        Post room(s)
@@ -626,32 +1273,50 @@ class RoomResource(BaseResource):
            description: Room created
        """
         data = self.prepare_data()
+        room = None
+        if obj_id:
+            room = Room.get_by_id(int(obj_id))
+            if not room:
+                abort(404, message="Room with key ({}) not found".format(obj_id))
+
+        room, deltas = self.build(data, room)
+        if obj_id:
+            save(room, **deltas)
+        else:
+            try:
+                # RoomForm's check runs outside the transaction, a concurrent create may have taken the number since
+                create([room], **deltas)
+            except EntityExists:
+                raise CustomException(code=400, name='Validation Failed', data={
+                    'number': ['Room with number - {} already exists'.format(room.number)]})
+        return self.marshaller(room), 200 if obj_id else 201
+
+    def build(self, data, room=None):
+        """
+        validates request data and applies it to an existing room or a new one
+        :param data: request data
+        :param room: room to update, None to create one
+        :return: room, counter deltas
+        """
+        if room:
+            form = UpdateRoomForm(data, csrf_enabled=False)
+            if not form.validate():
+                raise CustomException(code=400, name='Validation Failed', data=self.prepare_errors(form.errors))
+
+            was_booked = bool(room.is_booked)
+            room.is_booked = form.is_booked.data if form.is_booked.data else room.is_booked
+            return room, {counters.OCCUPIED_ROOMS: int(bool(room.is_booked)) - int(was_booked)}
+
         form = RoomForm(data, csrf_enabled=False)
-        if form.validate():
-            if obj_id:
-                room = Room.get_by_id(int(obj_id))
-                if not room:
-                    abort(404, message="Room with key ({}) not found".format(obj_id))
-
-                room.is_booked = form.is_booked.data if form.is_booked.data else room.is_booked
-                room.put()
-
-                output = self.output_fields
-                output.update(self.resource_fields)
-                return marshal(room, output), 200
-
-            room = Room(number=form.number.data, is_booked=form.is_booked.data)
-            room.put()
-            room.id = str(room.key.id())
-            room.put()
-            output = self.output_fields
-            output.update(self.resource_fields)
-            return marshal(room, output), 201
+        if not form.validate():
+            raise CustomException(code=400, name='Validation Failed', data=self.prepare_errors(form.errors))
 
-        error_data = self.prepare_errors(form.errors)
-        raise CustomException(code=400, name='Validation Failed', data=error_data)
+        room = Room(key=Room.key_for_number(form.number.data), id=str(form.number.data),
+                    number=form.number.data, is_booked=form.is_booked.data)
+        return room, {counters.ROOMS: 1, counters.OCCUPIED_ROOMS: int(bool(room.is_booked))}
 
     @auth.login_required
+    @response_cache.invalidates('Room')
     def delete(self, obj_id):
         """
         DELETE room
@@ -670,7 +1335,7 @@ class RoomResource(BaseResource):
         """
         try:
             room = Room.get_by_id(int(obj_id))
-            room.key.delete()
+            remove(room.key, **{counters.ROOMS: -1, counters.OCCUPIED_ROOMS: -int(bool(room.is_booked))})
             return True, 204
         except Exception:
             raise CustomException(code=400, name='Validation Failed',
@@ -683,10 +1348,28 @@ class BookingResource(BaseResource):
     resource_fields = {
         'customerID': fields.String,
         'room_number': fields.String,
-        'is_active': fields.Boolean
+        'is_active': fields.Boolean,
+        'check_in': fields.DateTime(dt_format='iso8601'),
+        'check_out': fields.DateTime(dt_format='iso8601')
     }
+    expansions = ('customer', 'room')
+    marshaller = Marshaller(BaseResource.output_fields, resource_fields)
+    projectable = ('date_created', 'date_modified', 'customerID', 'room_number', 'is_active')
+    projections = (('customerID', 'date_created', 'is_active', 'room_number'), ('customerID', 'room_number'))
+    filters = {'is_active': inputs.boolean, 'customerID': six.text_type, 'room_number': int}
+    range_filters = ('date_created', 'check_in')
+    orderable = ('date_created', 'check_in', 'room_number')
+    indexes = (
+        (('is_active',), 'date_created'), (('is_active',), '-date_created'),
+        (('is_active',), 'check_in'), (('is_active',), '-check_in'),
+        (('customerID',), 'date_created'), (('customerID',), '-date_created'), (('customerID',), 'check_in'),
+        (('room_number',), '-date_created'), (('room_number',), 'check_in'),
+        (('customerID', 'is_active'), '-date_created'), (('is_active', 'room_number'), 'check_in')
+    )
 
     @auth.login_required
+    @response_cache.cached(30, 'Booking', 'Customer', 'Room')
+    @conditional('Booking', 'Customer', 'Room')
     def get(self, obj_id=None):
         """
         Gets booking(s).
@@ -697,6 +1380,66 @@ class BookingResource(BaseResource):
         parameters:
           - in: path
             name: obj_id
+          - in: query
+            name: ids
+            type: string
+            description: comma separated booking ids to fetch in one call, missing ids are reported inline
+          - in: query
+            name: limit
+            type: integer
+            description: maximum number of results per page
+          - in: query
+            name: cursor
+            type: string
+            description: next_cursor value returned by the previous page
+          - in: query
+            name: fields
+            type: string
+            description: comma separated fields to return, loaded with a keys-only or projection query when possible
+          - in: query
+            name: stream
+            type: boolean
+            description: stream up to STREAM_MAX_RESULTS bookings in large batches, continue from next_cursor
+          - in: query
+            name: expand
+            type: string
+            description: comma separated related objects to embed, customer and/or room
+          - in: query
+            name: count_only
+            type: boolean
+            description: return only the total number of bookings
+          - in: query
+            name: is_active
+            type: boolean
+            description: only return active or cancelled bookings
+          - in: query
+            name: customerID
+            type: string
+            description: only return the customer's bookings
+          - in: query
+            name: room_number
+            type: integer
+            description: only return the room's bookings
+          - in: query
+            name: date_created_from
+            type: string
+            description: only return bookings with date_created on or after this YYYY-MM-DD date
+          - in: query
+            name: date_created_to
+            type: string
+            description: only return bookings with date_created before this YYYY-MM-DD date
+          - in: query
+            name: check_in_from
+            type: string
+            description: only return bookings with check_in on or after this YYYY-MM-DD date
+          - in: query
+            name: check_in_to
+            type: string
+            description: only return bookings with check_in before this YYYY-MM-DD date
+          - in: query
+            name: order_by
+            type: string
+            description: one of date_created, check_in, room_number, prefixed with - for descending order
         definitions:
           - schema:
               id: Booking
@@ -720,14 +1463,30 @@ class BookingResource(BaseResource):
             description: Returns the specified booking or a list of bookings
             $ref: '#/definitions/Booking'
         """
+        expand = self.parse_expand()
+        if expand and request.args.get('fields'):
+            abort(400, message="expand cannot be combined with fields")
+
         if not obj_id:
-            query = Booking.query().fetch()
-            output = self.output_fields
-            output.update(self.resource_fields)
+            if request.args.get('ids'):
+                return self.get_by_ids(Booking, request.args['ids']), 200
+
+            filters, orders = self.parse_filters(Booking)
+            if is_true(request.args.get('count_only')):
+                return {'count': self.count_async(Booking, counters.BOOKINGS, filters).get_result()}, 200
+
+            if is_true(request.args.get('stream')):
+                return self.stream(Booking.query(*filters).order(*orders))
+
+            # the count overlaps the page fetch
+            count = self.count_async(Booking, counters.BOOKINGS, filters)
+            query, marshal = self.select(Booking, filters, orders)
+            results, next_cursor = self.paginate(query)
 
             resp = {
-                'results': marshal(query, output),
-                'count': len(query)
+                'results': self.expand(expand, results, marshal(results)),
+                'count': count.get_result(),
+                'next_cursor': next_cursor
             }
 
             return resp, 200
@@ -738,13 +1497,64 @@ class BookingResource(BaseResource):
             if not booking:
                 abort(404, message="Booking with key ({}) not found".format(obj_id))
 
-            output = self.output_fields
-            output.update(self.resource_fields)
-            return marshal(booking, output), 200
+            return self.expand(expand, [booking], [self.marshaller(booking)])[0], 200
         except Exception:
             abort(404, message="Booking with key ({}) not found".format(obj_id))
 
+    def parse_expand(self):
+        """
+        reads the comma separated 'expand' request argument
+        :return: set of expansions
+        """
+        expand = set(name.strip() for name in request.args.get('expand', '').split(',') if name.strip())
+        unknown = expand - set(self.expansions)
+        if unknown:
+            abort(400, message="Unknown expand value(s): {}".format(', '.join(sorted(unknown))))
+        return expand
+
+    def expand(self, expand, bookings, results):
+        """
+        embeds the referenced customer and room in every marshalled booking,
+        resolving each kind for the whole page with a single get_multi
+        :param expand: set of expansions
+        :param bookings: booking objects
+        :param results: marshalled bookings, in the same order
+        :return: results
+        """
+        embeds = []
+        if 'customer' in expand:
+            keys = [ndb.Key(Customer, int(booking.customerID))
+                    if booking.customerID and booking.customerID.isdigit() else None for booking in bookings]
+            embeds.append(('customer', keys, CustomerResource.marshaller))
+
+        if 'room' in expand:
+            keys = [Room.key_for_number(booking.room_number) if booking.room_number is not None else None
+                    for booking in bookings]
+            embeds.append(('room', keys, RoomResource.marshaller))
+
+        # start every kind's get_multi before waiting on any of them
+        embeds = [(name, keys, marshaller, self.fetch_async(keys)) for name, keys, marshaller in embeds]
+        for name, keys, marshaller, future in embeds:
+            entities = future.get_result()
+            for result, key in zip(results, keys):
+                entity = entities.get(key)
+                result[name] = marshaller(entity) if entity else None
+
+        return results
+
+    @ndb.tasklet
+    def fetch_async(self, keys):
+        """
+        fetches the distinct keys with one get_multi
+        :param keys: keys, may contain duplicates and None
+        :return: future of a dict of key to entity
+        """
+        unique = list(set(key for key in keys if key))
+        entities = yield ndb.get_multi_async(unique)
+        raise ndb.Return(dict(zip(unique, entities)))
+
     @auth.login_required
+    @response_cache.invalidates('Booking', 'Room')
     def post(self, obj_id=None):
         """
        Create a new booking/ Update a booking
@@ -773,6 +1583,14 @@ class BookingResource(BaseResource):
                is_active:
                  type: boolean
                  description: room booked
+               check_in:
+                 type: string
+                 format: date
+                 description: check in date, books the room for [check_in, check_out)
+               check_out:
+                 type: string
+                 format: date
+                 description: check out date, required with check_in
        responses:
          201:
            description: Booking created
@@ -781,20 +1599,18 @@ class BookingResource(BaseResource):
         if obj_id:
             form = UpdateBookingForm(data, csrf_enabled=False)
             if form.validate():
-                booking = Booking.get_by_id(int(obj_id))
+                try:
+                    booking = bookings.set_active(obj_id, form.is_active.data)
+                except bookings.BookingError as e:
+                    raise CustomException(code=400, name='Validation Failed', data={e.field: [e.message]})
+                except datastore_errors.TransactionFailedError:
+                    raise CustomException(code=409, name='Conflict',
+                                          data={"description": 'Booking with key {} is being modified, '
+                                                               'try again'.format(obj_id)})
                 if not booking:
                     abort(404, message="Booking with key ({}) not found".format(obj_id))
 
-                booking.is_active = form.is_active.data
-                booking.put()
-
-                room = Room.query(Room.number == booking.room_number).get()
-                room.is_booked = True if booking.is_active is True else False
-                room.put()
-
-                output = self.output_fields
-                output.update(self.resource_fields)
-                return marshal(booking, output), 200
+                return self.marshaller(booking), 200
 
             error_data = self.prepare_errors(form.errors)
             raise CustomException(code=400, name='Validation Failed', data=error_data)
@@ -802,24 +1618,23 @@ class BookingResource(BaseResource):
         else:
             form = BookingForm(data, csrf_enabled=False)
             if form.validate():
-                booking = Booking(customerID=form.customerID.data, room_number=int(form.room_number.data),
-                                  is_active=True)
-                booking.put()
-                booking.id = str(booking.key.id())
-                booking.put()
-
-                room = Room.query(Room.number == booking.room_number).get()
-                room.is_booked = True if booking.is_active is True else False
-                room.put()
-
-                output = self.output_fields
-                output.update(self.resource_fields)
-                return marshal(booking, output), 201
+                try:
+                    booking = bookings.create_booking(form.customerID.data, form.room_number.data,
+                                                      form.check_in.data, form.check_out.data)
+                except bookings.BookingError as e:
+                    raise CustomException(code=400, name='Validation Failed', data={e.field: [e.message]})
+                except datastore_errors.TransactionFailedError:
+                    raise CustomException(code=409, name='Conflict',
+                                          data={"description": 'Room with number {} is being booked, '
+                                                               'try again'.format(form.room_number.data)})
+
+                return self.marshaller(booking), 201
 
             error_data = self.prepare_errors(form.errors)
             raise CustomException(code=400, name='Validation Failed', data=error_data)
 
     @auth.login_required
+    @response_cache.invalidates('Booking', 'Room')
     def delete(self, obj_id):
         """
         DELETE booking
@@ -837,10 +1652,527 @@ class BookingResource(BaseResource):
             description: Booking deleted
         """
         try:
-            booking = Booking.get_by_id(int(obj_id))
-            booking.key.delete()
-            return {"status": "Booking with id - {} successfully deleted" % obj_id}, 204
+            booking = bookings.delete_booking(obj_id)
         except Exception:
+            booking = None
+
+        if not booking:
             raise CustomException(code=400, name='Validation Failed',
                                   data={"description": 'DELETE failed for Booking with '
                                                        'key {}'.format(obj_id)})
+        return {"status": "Booking with id - {} successfully deleted".format(obj_id)}, 204
+
+
+class CustomerBatchResource(BaseResource):
+    marshaller = CustomerResource.marshaller
+
+    @auth.login_required
+    @response_cache.invalidates('Customer')
+    def post(self):
+        """
+        Batch customers
+        Create or update customers from a JSON array, items with an id update the existing customer
+        ---
+        tags:
+          - customers
+        parameters:
+          - in: body
+            name: body
+            schema:
+              type: array
+              items:
+                $ref: '#/definitions/Customer'
+        responses:
+          200:
+            description: Returns a status and the customer or validation errors for every item, in request order
+        """
+        results = self.save_batch(self.prepare_batch(), Customer, CustomerResource().build)
+        return {'results': results, 'count': len(results)}, 200
+
+
+class CustomerSearchResource(BaseResource):
+    marshaller = CustomerResource.marshaller
+
+    @auth.login_required
+    @response_cache.cached(60, 'Customer')
+    @conditional('Customer')
+    def get(self):
+        """
+        Searches customers.
+        Returns the customers whose names or phone number start with every term of q
+        ---
+        tags:
+          - customers
+        parameters:
+          - in: query
+            name: q
+            type: string
+            required: true
+            description: name and/or phone number prefixes, e.g. "smi" or "john smi" or "555-12"
+          - in: query
+            name: limit
+            type: integer
+            description: maximum number of results per page
+          - in: query
+            name: cursor
+            type: string
+            description: next_cursor value returned by the previous page
+        responses:
+          200:
+            description: Returns a page of matching customers
+            $ref: '#/definitions/Customer'
+        """
+        tokens = search.query_tokens(request.args.get('q', ''))
+        if not tokens:
+            abort(400, message="q must contain a name or phone number")
+
+        # one equality filter per token on the same repeated property, served by the built-in index
+        query = Customer.query(*[Customer.search_tokens == token for token in tokens])
+        results, next_cursor = self.paginate(query)
+
+        return {'results': self.marshaller(results), 'next_cursor': next_cursor}, 200
+
+
+class CustomerChangesResource(BaseResource):
+    marshaller = CustomerResource.marshaller
+
+    @auth.login_required
+    def get(self):
+        """
+        Customer changes.
+        Returns the customers written or deleted since a change sequence, oldest first
+        ---
+        tags:
+          - customers
+        parameters:
+          - in: query
+            name: since
+            type: integer
+            description: next_since value returned by the previous call, 0 to sync from scratch
+          - in: query
+            name: limit
+            type: integer
+            description: maximum number of changes to return
+        responses:
+          200:
+            description: Returns the changes, the next_since token and whether more changes are waiting
+        """
+        return self.changes(Customer), 200
+
+
+class RoomBatchResource(BaseResource):
+    marshaller = RoomResource.marshaller
+
+    @auth.login_required
+    @response_cache.invalidates('Room')
+    def post(self):
+        """
+        Batch rooms
+        Create or update rooms from a JSON array, items with an id update the existing room
+        ---
+        tags:
+          - rooms
+        parameters:
+          - in: body
+            name: body
+            schema:
+              type: array
+              items:
+                $ref: '#/definitions/Room'
+        responses:
+          200:
+            description: Returns a status and the room or validation errors for every item, in request order
+        """
+        items = self.prepare_batch()
+        # warm the context cache for the per-item room number checks in RoomForm
+        ndb.get_multi([Room.key_for_number(item['number']) for item in items
+                       if str(item.get('number', '')).isdigit()])
+
+        results = self.save_batch(items, Room, RoomResource().build)
+        return {'results': results, 'count': len(results)}, 200
+
+
+class RoomChangesResource(BaseResource):
+    marshaller = RoomResource.marshaller
+
+    @auth.login_required
+    def get(self):
+        """
+        Room changes.
+        Returns the rooms written or deleted since a change sequence, oldest first
+        ---
+        tags:
+          - rooms
+        parameters:
+          - in: query
+            name: since
+            type: integer
+            description: next_since value returned by the previous call, 0 to sync from scratch
+          - in: query
+            name: limit
+            type: integer
+            description: maximum number of changes to return
+        responses:
+          200:
+            description: Returns the changes, the next_since token and whether more changes are waiting
+        """
+        return self.changes(Room), 200
+
+
+class BookingBatchResource(BaseResource):
+    marshaller = BookingResource.marshaller
+
+    @auth.login_required
+    @response_cache.invalidates('Booking', 'Room')
+    def post(self):
+        """
+        Batch bookings
+        Create or update bookings from a JSON array, items with an id update the existing booking
+        ---
+        tags:
+          - bookings
+        parameters:
+          - in: body
+            name: body
+            schema:
+              type: array
+              items:
+                $ref: '#/definitions/Booking'
+        responses:
+          200:
+            description: Returns a status and the booking or validation errors for every item, in request order
+        """
+        items = self.prepare_batch()
+        # warm the context cache for the per-item room checks in BookingForm
+        ndb.get_multi([Room.key_for_number(item['room_number']) for item in items
+                       if str(item.get('room_number', '')).isdigit()])
+
+        results = []
+        for item in items:
+            if item.get('id') and not str(item['id']).isdigit():
+                results.append({'status': 404, 'errors': {'id': ['Booking with key ({}) not found'.format(
+                    item['id'])]}})
+                continue
+
+            data = MultiDict(item)
+            form = UpdateBookingForm(data, csrf_enabled=False) if item.get('id') else \
+                BookingForm(data, csrf_enabled=False)
+            if not form.validate():
+                results.append({'status': 400, 'errors': self.prepare_errors(form.errors)})
+                continue
+
+            try:
+                if item.get('id'):
+                    booking = bookings.set_active(item['id'], form.is_active.data)
+                else:
+                    booking = bookings.create_booking(form.customerID.data, form.room_number.data,
+                                                      form.check_in.data, form.check_out.data)
+            except bookings.BookingError as e:
+                results.append({'status': 400, 'errors': {e.field: [e.message]}})
+                continue
+            except datastore_errors.TransactionFailedError:
+                results.append({'status': 409, 'errors': {'description': ['Write failed, try again']}})
+                continue
+
+            if not booking:
+                results.append({'status': 404, 'errors': {'id': ['Booking with key ({}) not found'.format(
+                    item['id'])]}})
+                continue
+            results.append({'status': 200 if item.get('id') else 201, 'result': self.marshaller(booking)})
+
+        return {'results': results, 'count': len(results)}, 200
+
+
+class BookingChangesResource(BaseResource):
+    marshaller = BookingResource.marshaller
+
+    @auth.login_required
+    def get(self):
+        """
+        Booking changes.
+        Returns the bookings written or deleted since a change sequence, oldest first
+        ---
+        tags:
+          - bookings
+        parameters:
+          - in: query
+            name: since
+            type: integer
+            description: next_since value returned by the previous call, 0 to sync from scratch
+          - in: query
+            name: limit
+            type: integer
+            description: maximum number of changes to return
+        responses:
+          200:
+            description: Returns the changes, the next_since token and whether more changes are waiting
+        """
+        return self.changes(Booking), 200
+
+
+class AvailabilityResource(BaseResource):
+    marshaller = RoomResource.marshaller
+
+    @auth.login_required
+    @response_cache.cached(30, 'Room')
+    @conditional('Room')
+    def get(self):
+        """
+        Gets available rooms.
+        Returns the rooms that are free for every night from start up to, not including, end
+        ---
+        tags:
+          - rooms
+        parameters:
+          - in: query
+            name: start
+            type: string
+            format: date
+            required: true
+            description: check in date
+          - in: query
+            name: end
+            type: string
+            format: date
+            required: true
+            description: check out date
+        responses:
+          200:
+            description: Returns the available rooms
+            $ref: '#/definitions/Room'
+        """
+        start, end = self.parse_date_range()
+        rooms = availability.free_rooms(start, end)
+        return {'results': self.marshaller(rooms), 'count': len(rooms)}, 200
+
+
+class OccupancyResource(BaseResource):
+
+    @auth.login_required
+    @response_cache.cached(30, 'Room')
+    @conditional('Room')
+    def get(self):
+        """
+        Gets nightly occupancy.
+        Returns the number and percentage of occupied rooms for every night from start up to, not including, end
+        ---
+        tags:
+          - rooms
+        parameters:
+          - in: query
+            name: start
+            type: string
+            format: date
+            required: true
+            description: first night
+          - in: query
+            name: end
+            type: string
+            format: date
+            required: true
+            description: day after the last night
+        responses:
+          200:
+            description: Returns date, occupied and percent for every night
+        """
+        start, end = self.parse_date_range()
+        if not occupancy.covers(start, end):
+            abort(400, message="Occupancy is only kept for {} nights from {}".format(
+                occupancy.WINDOW_NIGHTS, date.fromordinal(occupancy.window_origin())))
+
+        results = [{'date': night.isoformat(), 'occupied': count, 'percent': percent}
+                   for night, count, percent in availability.nightly_occupancy(start, end)]
+        return {'results': results, 'count': len(results)}, 200
+
+
+class EventsResource(BaseResource):
+    # change event payloads match the resource representations
+    marshallers = {
+        'Customer': CustomerResource.marshaller,
+        'Room': RoomResource.marshaller,
+        'Booking': BookingResource.marshaller
+    }
+
+    def format_event(self, event):
+        """
+        formats a change event as a Server-Sent Event
+        :param event: event from the broker
+        :return:
+        """
+        data = {'kind': event['kind'], 'action': event['action'], 'id': event['id'], 'data': None}
+        if event['entity'] is not None:
+            data['data'] = self.marshallers[event['kind']](event['entity'])
+        return 'id: {}\ndata: {}\n\n'.format(event['event_id'], json.dumps(data))
+
+    @auth.login_required
+    def get(self):
+        """
+        Change events.
+        Single-instance prototype, only served when EVENT_STREAM_ENABLED is set.
+        Streams customer, room and booking writes and deletes as Server-Sent Events (text/event-stream).
+        Every event's data is a JSON object with the kind, action (put or delete), id and, for puts,
+        the object. The stream closes after EVENT_STREAM_SECONDS and EventSource reconnects,
+        replaying missed events by Last-Event-ID
+        ---
+        tags:
+          - events
+        parameters:
+          - in: header
+            name: Last-Event-ID
+            type: integer
+            description: id of the last event received, sent by EventSource when it reconnects
+        responses:
+          200:
+            description: Returns the event stream
+        """
+        if not current_app.config['EVENT_STREAM_ENABLED']:
+            abort(404, message="The event stream is disabled, see Config.EVENT_STREAM_ENABLED")
+
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+        stream_seconds = current_app.config['EVENT_STREAM_SECONDS']
+        heartbeat = current_app.config['EVENT_HEARTBEAT_SECONDS']
+
+        broker = events.get_broker()
+        queue = broker.subscribe(last_event_id)
+
+        def generate():
+            try:
+                deadline = time.time() + stream_seconds
+                yield 'retry: 1000\n\n'
+                while time.time() < deadline:
+                    try:
+                        event = queue.get(timeout=min(heartbeat, max(deadline - time.time(), 0)))
+                    except Empty:
+                        yield ': keep-alive\n\n'
+                        continue
+                    yield self.format_event(event)
+            finally:
+                broker.unsubscribe(queue)
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+
+class StatsResource(BaseResource):
+    counter_names = {
+        'customer_count': counters.CUSTOMERS,
+        'room_count': counters.ROOMS,
+        'occupied_room_count': counters.OCCUPIED_ROOMS,
+        'booking_count': counters.BOOKINGS,
+        'active_booking_count': counters.ACTIVE_BOOKINGS
+    }
+
+    @auth.login_required
+    def get(self):
+        """
+        Gets entity totals.
+        Returns the number of customers, rooms and bookings from the sharded counters,
+        and the credential cache hit and miss counts of the instance serving the request
+        ---
+        tags:
+          - stats
+        responses:
+          200:
+            description: Returns customer, room, occupied room, booking and active booking counts and credential_cache
+        """
+        totals = counters.get_counts(self.counter_names.values())
+        stats = dict((k, totals[v]) for k, v in self.counter_names.items())
+        stats['credential_cache'] = credential_cache.stats()
+        return stats, 200
+
+    @auth.login_required
+    @admin_required
+    def post(self):
+        """
+        Rebuild entity totals.
+        Recounts customers, rooms and bookings from the datastore and resets the sharded counters, admins only
+        ---
+        tags:
+          - stats
+        responses:
+          200:
+            description: Returns the rebuilt counts
+          403:
+            description: The user is not an admin
+        """
+        futures = {
+            counters.CUSTOMERS: Customer.query().count_async(),
+            counters.ROOMS: Room.query().count_async(),
+            counters.OCCUPIED_ROOMS: Room.query(Room.is_booked == True).count_async(),
+            counters.BOOKINGS: Booking.query().count_async(),
+            counters.ACTIVE_BOOKINGS: Booking.query(Booking.is_active == True).count_async()
+        }
+
+        for name, future in futures.items():
+            counters.reset(name, future.get_result())
+
+        # conditional GETs and cached responses built from the old totals are stale now
+        kinds = [model._get_kind() for model in (Customer, Room, Booking)]
+        for kind in kinds:
+            counters.increment(counters.version(kind))
+        response_cache.invalidate(*kinds)
+
+        return self.get()
+
+
+class DashboardResource(BaseResource):
+
+    def build(self):
+        """
+        computes the home page summary from the sharded counters, the latest bookings and the nightly occupancy,
+        starting the counter and booking reads before the occupancy is read
+        :return:
+        """
+        totals = counters.get_counts_async(StatsResource.counter_names.values())
+        recent = Booking.query().order(-Booking.booked_at).fetch_async(
+            current_app.config['DASHBOARD_RECENT_BOOKINGS'])
+        occupancy = self.occupancy()
+
+        totals = totals.get_result()
+        recent = recent.get_result()
+        return {
+            'counts': dict((k, totals[v]) for k, v in StatsResource.counter_names.items()),
+            'recent_bookings': BookingResource().expand({'customer'}, recent, BookingResource.marshaller(recent)),
+            'occupancy': occupancy
+        }
+
+    def occupancy(self):
+        """
+        occupancy of the coming nights from the rooms' bitmaps. It scans every room, so it is cached apart from
+        the summary for DASHBOARD_OCCUPANCY_TTL seconds instead of being rebuilt after every write
+        :return: list of nights
+        """
+        today = date.today()
+        cache_key = 'dashboard-occupancy:{}'.format(today.isoformat())
+        occupancy = memcache.get(cache_key)
+        if occupancy is None:
+            nights = availability.nightly_occupancy(
+                today, today + timedelta(days=current_app.config['DASHBOARD_OCCUPANCY_NIGHTS']))
+            occupancy = [{'date': night.isoformat(), 'occupied': count, 'percent': percent}
+                         for night, count, percent in nights]
+            memcache.set(cache_key, occupancy, time=current_app.config['DASHBOARD_OCCUPANCY_TTL'])
+        return occupancy
+
+    @auth.login_required
+    def get(self):
+        """
+        Gets the dashboard.
+        Returns the entity totals, the latest bookings with their customers and the occupancy of the coming nights
+        ---
+        tags:
+          - stats
+        responses:
+          200:
+            description: Returns counts, recent_bookings and occupancy
+        """
+        # the key changes with every write and every day, the ttl bounds how long an entry is kept
+        versions = counters.get_versions(('Customer', 'Room', 'Booking'))[0]
+        cache_key = 'dashboard:{}:{}'.format(date.today().isoformat(),
+                                             ':'.join(str(versions[kind]) for kind in sorted(versions)))
+
+        dashboard = memcache.get(cache_key)
+        if dashboard is None:
+            dashboard = self.build()
+            memcache.set(cache_key, dashboard, time=current_app.config['DASHBOARD_CACHE_TTL'])
+        return dashboard, 200
@@ -0,0 +1,76 @@
+import re
+
+import six
+
+# longest prefix indexed per word, longer query terms are truncated to it
+MAX_TOKEN_LENGTH = 20
+
+WORD_SEPARATOR = re.compile(r'[\W_]+', re.UNICODE)
+PHONE_TERM = re.compile(r'^[\d\s()+.-]*\d[\d\s()+.-]*$')
+
+
+def words(value):
+    """
+    splits a value into lower case alphanumeric words
+    :param value:
+    :return: list of words
+    """
+    if value is None:
+        return []
+    return [word for word in WORD_SEPARATOR.split(six.text_type(value).lower()) if word]
+
+
+def digits(value):
+    """
+    strips everything but digits from a phone number, and its leading zeros:
+    phone numbers are stored as integers, so "0803..." is indexed as "803..."
+    :param value:
+    :return:
+    """
+    return re.sub(r'\D', '', six.text_type(value)).lstrip('0') if value is not None else ''
+
+
+def prefixes(word):
+    """
+    every prefix of word, up to MAX_TOKEN_LENGTH characters
+    :param word:
+    :return: list of prefixes
+    """
+    return [word[:length] for length in range(1, min(len(word), MAX_TOKEN_LENGTH) + 1)]
+
+
+def index_tokens(names=(), phone_numbers=()):
+    """
+    search tokens stored on an entity, the prefixes of every name word and phone number
+    :param names: name values, split into words
+    :param phone_numbers: phone number values, reduced to digits
+    :return: sorted list of unique tokens
+    """
+    tokens = set()
+    for name in names:
+        for word in words(name):
+            tokens.update(prefixes(word))
+    for phone_number in phone_numbers:
+        tokens.update(prefixes(digits(phone_number)))
+    return sorted(tokens)
+
+
+def query_tokens(q):
+    """
+    tokens an entity must carry to match the search string, every term matches a name or phone number prefix
+    :param q: search string, e.g. "smi" or "john smi" or "555-12"
+    :return: sorted list of unique tokens
+    """
+    q = six.text_type(q).strip()
+    if PHONE_TERM.match(q):
+        # a phone number may be written with spaces, e.g. "(555) 123 4"
+        return [digits(q)[:MAX_TOKEN_LENGTH]] if digits(q) else []
+
+    tokens = set()
+    for term in q.split():
+        if PHONE_TERM.match(term):
+            if digits(term):
+                tokens.add(digits(term)[:MAX_TOKEN_LENGTH])
+        else:
+            tokens.update(word[:MAX_TOKEN_LENGTH] for word in words(term))
+    return sorted(tokens)
@@ -1,8 +1,20 @@
+from collections import OrderedDict
 from functools import wraps
+import hashlib
+import hmac
 import json
+import threading
+import time
+import uuid
 
-from flask import g, session, current_app, redirect, url_for, request
+import six
+from flask import g, session, current_app, redirect, url_for, request, abort
+from flask_restful import fields, marshal
+from flask_restful.fields import is_indexable_but_not_string
+from flask_restful.utils import unpack
 from werkzeug.exceptions import HTTPException, HTTP_STATUS_CODES
+from werkzeug.http import is_resource_modified
+from werkzeug.wrappers import Response
 
 
 def login_required(f):
@@ -19,6 +31,20 @@ def login_required(f):
     return decorated_function
 
 
+def admin_required(f):
+    """
+    rejects users without is_admin, apply under a login check
+    :param func:
+    :return:
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not getattr(g.get('user'), 'is_admin', False):
+            abort(403)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
 class CustomException(HTTPException):
     def __init__(self, code, data, description=None, name=None):
         """
@@ -50,6 +76,270 @@ class CustomException(HTTPException):
         return resp
 
 
+class Marshaller(object):
+    """
+    Serializes objects with a plan compiled once from flask_restful field maps.
+    Produces the same JSON as flask_restful.marshal without walking the field objects for every entity
+    """
+    formatters = {
+        fields.Raw: lambda value: value,
+        fields.String: six.text_type,
+        fields.Integer: int,
+        fields.Boolean: bool
+    }
+
+    def __init__(self, *field_maps):
+        """
+        :param field_maps: flask_restful field dicts, merged in order
+        """
+        self.fields = {}
+        for field_map in field_maps:
+            self.fields.update(field_map)
+
+        self.plan = tuple((key, self.compile(key, field)) for key, field in self.fields.items())
+
+    def compile(self, key, field):
+        """
+        builds an output function for a single field
+        :param key: output key
+        :param field: flask_restful field class or instance
+        :return: function taking the object and returning the field value
+        """
+        if isinstance(field, type):
+            field = field()
+
+        attribute = key if field.attribute is None else field.attribute
+        output = getattr(type(field).output, '__func__', type(field).output)
+        if not isinstance(attribute, six.string_types) or '.' in attribute or \
+                output is not getattr(fields.Raw.output, '__func__', fields.Raw.output):
+            return lambda obj: field.output(key, obj)
+
+        formatter = self.formatters.get(type(field), field.format)
+        default = field.default
+
+        def get(obj):
+            value = getattr(obj, attribute, None)
+            return default if value is None else formatter(value)
+
+        return get
+
+    def __call__(self, data):
+        """
+        marshals an object or a list of objects
+        :param data:
+        :return:
+        """
+        if isinstance(data, (list, tuple)):
+            return [self.marshal_one(obj) for obj in data]
+        return self.marshal_one(data)
+
+    def marshal_one(self, obj):
+        """
+        marshals a single object, dicts and other indexables take the generic path
+        :param obj:
+        :return:
+        """
+        if is_indexable_but_not_string(obj):
+            return marshal(obj, self.fields)
+        return dict((key, get(obj)) for key, get in self.plan)
+
+
+class CredentialCache(object):
+    """
+    Bounded, time limited cache of recently verified credentials so HTTP Basic auth
+    does not re-hash the password on every request.
+    Entries hold an HMAC of the username, password and stored password hash, never the password itself,
+    so a password change invalidates the entry
+    """
+
+    def __init__(self, secret, max_size=1024, ttl=300):
+        """
+        :param secret: HMAC key
+        :param max_size: maximum number of cached users, least recently used are evicted first
+        :param ttl: seconds a verified credential stays valid
+        """
+        self.secret = secret
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def digest(self, username, password, password_hash):
+        """
+        keyed digest of a credential
+        :param username:
+        :param password: password supplied by the client
+        :param password_hash: password hash stored on the user
+        :return:
+        """
+        # werkzeug hands over HTTP Basic credentials as byte strings, only unicode parts need encoding
+        parts = [part.encode('utf-8') if isinstance(part, six.text_type) else str(part or '')
+                 for part in (username, password, password_hash)]
+        return hmac.new(self.secret, b'\0'.join(parts), hashlib.sha256).hexdigest()
+
+    def verify(self, user, password):
+        """
+        checks a password against a user, consulting the cache before running user.check_password
+        :param user: user object
+        :param password: password supplied by the client
+        :return: True if the password is valid
+        """
+        digest = self.digest(user.username, password, user.password)
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(user.username)
+            if entry and entry[0] == digest and entry[1] > now:
+                # re-insert to mark the entry as most recently used
+                self.entries[user.username] = self.entries.pop(user.username)
+                self.hits += 1
+                return True
+            self.misses += 1
+
+        if not user.check_password(password):
+            return False
+
+        with self.lock:
+            self.entries[user.username] = (digest, now + self.ttl)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return True
+
+    def stats(self):
+        """
+        hit and miss counts of this instance's cache
+        :return: dict of hits, misses and cached users
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+    def invalidate(self, username):
+        """
+        removes a user's cached credential, call when the password changes or the user is deleted
+        :param username:
+        :return:
+        """
+        with self.lock:
+            self.entries.pop(username, None)
+
+
+class ResponseCache(object):
+    """
+    Cache of read endpoint responses in a werkzeug.contrib.cache backend.
+    Keys hold the endpoint, path, query arguments, auth scope and a generation token of every kind
+    the response is built from, writes replace the generation tokens of the kinds they change
+    so cached responses of those kinds are never read again and expire with their ttl
+    """
+
+    def __init__(self, backend):
+        """
+        :param backend: werkzeug.contrib.cache.BaseCache instance, shared between instances to share invalidations
+        """
+        self.backend = backend
+
+    @staticmethod
+    def generation_key(kind):
+        """
+        cache key of a kind's generation token
+        :param kind: datastore kind
+        :return:
+        """
+        return 'generation:{}'.format(kind)
+
+    def generations(self, kinds):
+        """
+        reads the generation tokens of kinds, creating missing (new or evicted) ones
+        :param kinds: datastore kinds
+        :return: list of tokens
+        """
+        keys = [self.generation_key(kind) for kind in kinds]
+        tokens = self.backend.get_many(*keys)
+        for index, token in enumerate(tokens):
+            if token is None:
+                # a concurrent request may create the token first, every request then uses the stored one
+                self.backend.add(keys[index], uuid.uuid4().hex, timeout=0)
+                tokens[index] = self.backend.get(keys[index])
+        return tokens
+
+    def invalidate(self, *kinds):
+        """
+        drops the cached responses of kinds by replacing their generation tokens
+        :param kinds: datastore kinds
+        :return:
+        """
+        for kind in kinds:
+            self.backend.set(self.generation_key(kind), uuid.uuid4().hex, timeout=0)
+
+    def key(self, kinds):
+        """
+        cache key of the current request
+        :param kinds: datastore kinds the response is built from
+        :return:
+        """
+        user = g.get('user')
+        scope = 'admin' if user is not None and user.is_admin else 'user' if user is not None else 'anonymous'
+        key = u'{} {} {} {} {}'.format(request.endpoint, request.path, sorted(request.args.items(multi=True)),
+                                       scope, self.generations(kinds))
+        return 'response:{}'.format(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def cached(self, ttl, *kinds):
+        """
+        caches the successful responses of a resource method for ttl seconds, streamed responses are not cached.
+        A cached ETag matching If-None-Match is answered with 304
+        :param ttl: seconds
+        :param kinds: datastore kinds whose writes change the response
+        :return:
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                key = self.key(kinds)
+                resp = self.backend.get(key)
+                if resp is None:
+                    resp = func(*args, **kwargs)
+                    if isinstance(resp, Response):
+                        return resp
+                    resp = unpack(resp)
+                    if resp[1] == 200:
+                        self.backend.set(key, resp, timeout=ttl)
+                    return resp
+
+                data, code, headers = resp
+                if 'ETag' in headers and not is_resource_modified(request.environ, etag=headers['ETag']):
+                    return Response(status=304, headers=headers)
+                return resp
+            return wrapper
+        return decorator
+
+    def invalidates(self, *kinds):
+        """
+        invalidates the cached responses of kinds once a resource method that writes them returns
+        :param kinds: datastore kinds the method writes
+        :return:
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.invalidate(*kinds)
+            return wrapper
+        return decorator
+
+
+def is_true(value):
+    """
+    checks if a request argument string represents a true value
+    :param value:
+    :return:
+    """
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
 def is_json(value):
     """
     checks if a string is a JSON object
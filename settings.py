@@ -6,3 +6,47 @@ class Config(object):
     DEBUG = True
     HOME_URL = 'index'
     LOGIN_URL = 'login'
+
+    # verified HTTP Basic credentials cached per instance
+    CREDENTIAL_CACHE_SIZE = 1024
+    CREDENTIAL_CACHE_TTL = 300
+
+    # pagination for collection GET requests
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
+
+    # maximum number of items in a /batch request
+    MAX_BATCH_SIZE = 1000
+
+    # datastore batch size for streamed collection exports, and the most results one export request returns:
+    # the python27 runtime buffers the whole response, so larger exports are paged with next_cursor
+    STREAM_BATCH_SIZE = 200
+    STREAM_MAX_RESULTS = 5000
+
+    # changes younger than this are left out of /changes responses until their transactions have committed
+    SYNC_SETTLE_SECONDS = 5
+
+    # /v1/events is a single-instance prototype, off by default: python27 standard buffers responses, so every
+    # open stream holds a request thread for EVENT_STREAM_SECONDS, and events.Broker only sees its own instance's
+    # writes. With it off the pages reload their data when a view loads
+    EVENT_STREAM_ENABLED = False
+    # change event fan-out for /v1/events, a class with publish, subscribe and unsubscribe methods
+    EVENT_BROKER = 'events.Broker'
+    # events kept per instance for clients reconnecting with Last-Event-ID
+    EVENT_HISTORY_SIZE = 100
+    # seconds an event stream stays open before the client reconnects, and between keep-alive comments
+    EVENT_STREAM_SECONDS = 25
+    EVENT_HEARTBEAT_SECONDS = 10
+
+    # /v1/dashboard: seconds a summary is cached, bookings listed and nights of occupancy from today.
+    # The occupancy reads every room, it is cached on its own for DASHBOARD_OCCUPANCY_TTL whatever the writes
+    DASHBOARD_CACHE_TTL = 30
+    DASHBOARD_OCCUPANCY_TTL = 300
+    DASHBOARD_RECENT_BOOKINGS = 10
+    DASHBOARD_OCCUPANCY_NIGHTS = 7
+
+    # response cache for read endpoints: a werkzeug.contrib.cache class and its arguments.
+    # MemcachedCache shares entries and invalidations between instances, SimpleCache keeps them per instance
+    # and NullCache turns caching off
+    RESPONSE_CACHE = 'werkzeug.contrib.cache.MemcachedCache'
+    RESPONSE_CACHE_OPTIONS = {'key_prefix': 'hotels:'}
@@ -4,82 +4,57 @@
 
 var app = angular.module('hotels.controllers', []);
 
-app.controller('HomeController', function ($scope, $timeout, $q, Customer, Booking, Room) {
+app.controller('HomeController', function ($scope, $timeout, $q, Dashboard, Events) {
 
-    var load_bookings = function () {
+    var load_stats = function () {
         var deferred = $q.defer();
 
         $timeout(function () {
-            var bookings = Booking.query();
-
-            bookings.$promise.then(function (data) {
-                $scope.data.bookings = data.results
-                $scope.data.booking_count = data.count
-            })
-        });
-
-        return deferred.promise;
-    };
-
-    var load_rooms = function () {
-        var deferred = $q.defer();
-
-        $timeout(function () {
-            var rooms = Room.query();
-            rooms.$promise.then(function (data) {
-                $scope.data.rooms = data.results
-                $scope.data.room_count = data.count
+            var dashboard = Dashboard.get();
+
+            dashboard.$promise.then(function (data) {
+                $scope.data.booking_count = data.counts.booking_count
+                $scope.data.room_count = data.counts.room_count
+                $scope.data.customer_count = data.counts.customer_count
+                $scope.data.recent_bookings = data.recent_bookings
+                $scope.data.occupancy = data.occupancy
             })
         });
 
         return deferred.promise;
     };
 
-    var load_customers = function () {
-        var deferred = $q.defer();
-
-        $timeout(function () {
-            var customers = Customer.query();
-
-            customers.$promise.then(function (data) {
-                $scope.data.customers = data.results
-                $scope.data.customer_count = data.count
-            })
-        });
-
-        return deferred.promise;
-    };
-
-    var startParallel = function () {
-
-        $q.all([load_bookings(), load_rooms(), load_customers()]).then(
-            function (successResult) {
-            }, function (failureReason) {
-                // renew()
-            }
-        );
-    };
-
     var init = function () {
 
-        $scope.data = {"rooms": [], "room_count": 0, 'bookings': [], "booking_count": 0, "customers": [], "customer_count": 0};
-        startParallel();
+        $scope.data = {"room_count": 0, "booking_count": 0, "customer_count": 0, "recent_bookings": [], "occupancy": []};
+        load_stats();
+
+        // reload the totals once a burst of changes has settled
+        var pending = null;
+        var reload = function () {
+            $timeout.cancel(pending);
+            pending = $timeout(load_stats, 1000);
+        };
+        Events.subscribe($scope, 'Customer', reload);
+        Events.subscribe($scope, 'Room', reload);
+        Events.subscribe($scope, 'Booking', reload);
     }
 
     init();
 });
 
-app.controller('CustomerController', function ($scope, $rootScope, Customer, $timeout, $q, $state, $stateParams) {
+app.controller('CustomerController', function ($scope, $rootScope, Customer, Events, $timeout, $q, $state, $stateParams) {
 
-    var load_customers = function () {
+    var load_customers = function (cursor) {
         var deferred = $q.defer();
 
         $timeout(function () {
-            var customers = Customer.query();
+            var customers = Customer.query(cursor ? {cursor: cursor} : {});
 
             customers.$promise.then(function (data) {
-                $scope.data.customers = data.results
+                $scope.data.customers = $scope.data.customers.concat(data.results)
                 $scope.data.customer_count = data.count
+                $scope.data.next_cursor = data.next_cursor
             })
         });
 
@@ -119,6 +94,10 @@ app.controller('CustomerController', function ($scope, $rootScope, Customer, $ti
 
     };
 
+    $scope.load_more = function () {
+        load_customers($scope.data.next_cursor);
+    };
+
     $scope.delete = function (customer_id) {
         var customer = new Customer({id: customer_id});
         customer.$delete({id: customer_id}, function (data, status) {
@@ -132,6 +111,7 @@ app.controller('CustomerController', function ($scope, $rootScope, Customer, $ti
 
     $scope.data = {"customers": [], "customer_count": 0}
     startParallel();
+    Events.track($scope, 'Customer', 'customers', 'customer_count');
     $scope.form = {'first_name': null, "last_name": null, "address": null, "phone_number": null};
 
     if ($stateParams.id) {
@@ -150,16 +130,17 @@ app.controller('CustomerController', function ($scope, $rootScope, Customer, $ti
     ;
 });
 
-app.controller('RoomController', function ($scope, $rootScope, Room, $timeout, $q, $state) {
+app.controller('RoomController', function ($scope, $rootScope, Room, Events, $timeout, $q, $state) {
 
-    var load_rooms = function () {
+    var load_rooms = function (cursor) {
         var deferred = $q.defer();
 
         $timeout(function () {
-            var rooms = Room.query();
+            var rooms = Room.query(cursor ? {cursor: cursor, fields: 'id,number,is_booked'} : {fields: 'id,number,is_booked'});
             rooms.$promise.then(function (data) {
-                $scope.data.rooms = data.results
+                $scope.data.rooms = $scope.data.rooms.concat(data.results)
                 $scope.data.room_count = data.count
+                $scope.data.next_cursor = data.next_cursor
             })
         });
 
@@ -179,6 +160,7 @@ app.controller('RoomController', function ($scope, $rootScope, Room, $timeout, $
     var init = function () {
         $scope.data = {"rooms": [], "room_count": 0, 'error': null};
         startParallel();
+        Events.track($scope, 'Room', 'rooms', 'room_count');
         $scope.form = {'number': 0};
     }
 
@@ -195,6 +177,10 @@ app.controller('RoomController', function ($scope, $rootScope, Room, $timeout, $
         })
     }
 
+    $scope.load_more = function () {
+        load_rooms($scope.data.next_cursor);
+    };
+
     $scope.delete = function (room_id) {
         var room = new Room({id: room_id});
         room.$delete({id: room_id}, function (data, status) {
@@ -208,31 +194,45 @@ app.controller('RoomController', function ($scope, $rootScope, Room, $timeout, $
 
 });
 
-app.controller('BookingController', function ($scope, $rootScope, Booking, Room, Customer, $timeout, $q, $state, $stateParams) {
+app.controller('BookingController', function ($scope, $rootScope, Booking, Room, Customer, Events, $timeout, $q, $state, $stateParams) {
 
-    var load_bookings = function () {
+    var load_bookings = function (cursor) {
         var deferred = $q.defer();
 
         $timeout(function () {
-            var bookings = Booking.query();
+            var bookings = Booking.query(cursor ? {cursor: cursor, expand: 'customer'} : {expand: 'customer'});
 
             bookings.$promise.then(function (data) {
-                $scope.data.bookings = data.results
+                $scope.data.bookings = $scope.data.bookings.concat(data.results)
                 $scope.data.bookings_count = data.count
+                $scope.data.next_cursor = data.next_cursor
             })
         });
 
         return deferred.promise;
     };
 
+    // the pickers need every room and customer, so follow next_cursor through large pages of the listed fields
+    var load_all = function (resource, params, done, results, cursor) {
+        var page = resource.query(angular.extend({limit: 500}, params, cursor ? {cursor: cursor} : {}));
+
+        page.$promise.then(function (data) {
+            results = (results || []).concat(data.results)
+            if (data.next_cursor) {
+                load_all(resource, params, done, results, data.next_cursor)
+            } else {
+                done(results, data.count)
+            }
+        })
+    };
+
     var load_rooms = function () {
         var deferred = $q.defer();
 
         $timeout(function () {
-            var rooms = Room.query();
-            rooms.$promise.then(function (data) {
-                $scope.data.rooms = data.results
-                $scope.data.room_count = data.count
+            load_all(Room, {fields: 'id,number'}, function (results, count) {
+                $scope.data.rooms = results
+                $scope.data.room_count = count
             })
         });
 
@@ -243,11 +243,9 @@ app.controller('BookingController', function ($scope, $rootScope, Booking, Room,
         var deferred = $q.defer();
 
         $timeout(function () {
-            var customers = Customer.query();
-
-            customers.$promise.then(function (data) {
-                $scope.data.customers = data.results
-                $scope.data.customer_count = data.count
+            load_all(Customer, {fields: 'id,first_name,last_name'}, function (results, count) {
+                $scope.data.customers = results
+                $scope.data.customer_count = count
             })
         });
 
@@ -275,6 +273,7 @@ app.controller('BookingController', function ($scope, $rootScope, Booking, Room,
             "error": null
         }
         startParallel()
+        Events.track($scope, 'Booking', 'bookings', 'bookings_count');
         $scope.form = {'room_number': 0, "customerID": null};
         if ($stateParams.id) {
             $timeout(function () {
@@ -293,6 +292,10 @@ app.controller('BookingController', function ($scope, $rootScope, Booking, Room,
 
     init();
 
+    $scope.load_more = function () {
+        load_bookings($scope.data.next_cursor);
+    };
+
     $scope.delete = function (booking_id) {
         var booking = new Booking({id: booking_id});
         booking.$delete({id: booking_id}, function (data, status) {
@@ -47,4 +47,73 @@ app.factory('Room', function ($resource) {
           method: 'PUT' // this method issues a PUT request
         }
     });
-});
\ No newline at end of file
+});
+
+app.factory('Stats', function ($resource) {
+    return $resource('/v1/stats');
+});
+
+app.factory('Dashboard', function ($resource) {
+    return $resource('/v1/dashboard');
+});
+
+// change events pushed by /v1/events, one EventSource shared by every controller.
+// Only connects when the server enables the stream (window.EVENT_STREAM_ENABLED), views reload their data otherwise
+app.factory('Events', function ($rootScope) {
+    var source = null;
+
+    var connect = function () {
+        if (source || !window.EventSource || !window.EVENT_STREAM_ENABLED) {
+            return;
+        }
+        source = new EventSource('/v1/events');
+        source.onmessage = function (message) {
+            var change = JSON.parse(message.data);
+            $rootScope.$apply(function () {
+                $rootScope.$broadcast('change:' + change.kind, change);
+            });
+        };
+    };
+
+    return {
+        // calls listener(change) for every change to kind ('Customer', 'Room' or 'Booking') while scope lives
+        subscribe: function (scope, kind, listener) {
+            connect();
+            scope.$on('$destroy', $rootScope.$on('change:' + kind, function (event, change) {
+                listener(change);
+            }));
+        },
+
+        // applies a change to a list of objects, returns false if the object is not in the list
+        patch: function (list, change) {
+            for (var i = 0; i < list.length; i++) {
+                if (list[i].id === change.id) {
+                    if (change.action === 'delete') {
+                        list.splice(i, 1);
+                    }
+                    else {
+                        angular.extend(list[i], change.data);
+                    }
+                    return true;
+                }
+            }
+            return false;
+        },
+
+        // keeps scope.data[list] and scope.data[count] in step with changes to kind,
+        // objects created elsewhere are added once the last page is loaded
+        track: function (scope, kind, list, count) {
+            var patch = this.patch;
+            this.subscribe(scope, kind, function (change) {
+                var found = patch(scope.data[list], change);
+                if (change.action === 'delete') {
+                    scope.data[count] -= 1;
+                }
+                else if (!found && !scope.data.next_cursor) {
+                    scope.data[list].push(change.data);
+                    scope.data[count] += 1;
+                }
+            });
+        }
+    };
+});
@@ -0,0 +1,104 @@
+"""
+concurrency checks for bookings.create_booking against the App Engine testbed.
+Run from the project root with the App Engine SDK on the path:
+
+    PYTHONPATH=lib:.:$APPENGINE_SDK python -m unittest discover tests
+"""
+from datetime import date, timedelta
+import threading
+import unittest
+
+try:
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+except ImportError:
+    pass
+
+try:
+    from google.appengine.api import datastore_errors
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb, testbed
+except ImportError:
+    testbed = None
+
+if testbed is not None:
+    import counters
+    from bookings import BookingError, create_booking
+    from models import Booking, Room
+
+# concurrent booking attempts per test
+ATTEMPTS = 10
+ROOM_NUMBER = 101
+
+
+@unittest.skipIf(testbed is None, 'the App Engine SDK is not on the path')
+class CreateBookingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        # every write is visible to queries at once, conflicts are left to the transactions under test
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        ndb.get_context().clear_cache()
+
+        Room(key=Room.key_for_number(ROOM_NUMBER), id=str(ROOM_NUMBER), number=ROOM_NUMBER, is_booked=False).put()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def book_concurrently(self, *args):
+        """
+        calls create_booking from ATTEMPTS threads released together
+        :param args: create_booking arguments after the customer id
+        :return: bookings made, errors raised
+        """
+        start = threading.Event()
+        lock = threading.Lock()
+        bookings, errors = [], []
+
+        def attempt(customer_id):
+            start.wait()
+            try:
+                booking = create_booking(customer_id, *args)
+            except (BookingError, datastore_errors.TransactionFailedError) as e:
+                with lock:
+                    errors.append(e)
+            else:
+                with lock:
+                    bookings.append(booking)
+            finally:
+                ndb.get_context().clear_cache()
+
+        threads = [threading.Thread(target=attempt, args=(str(index),)) for index in range(ATTEMPTS)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        return bookings, errors
+
+    def test_undated_bookings(self):
+        bookings, errors = self.book_concurrently(ROOM_NUMBER)
+
+        self.assertEqual(len(bookings), 1)
+        self.assertEqual(len(errors), ATTEMPTS - 1)
+        self.assertEqual(Booking.query().count(), 1)
+        self.assertTrue(Room.get_by_number(ROOM_NUMBER).is_booked)
+        self.assertEqual(counters.get_count(counters.OCCUPIED_ROOMS), 1)
+        self.assertEqual(counters.get_count(counters.ACTIVE_BOOKINGS), 1)
+
+    def test_overlapping_stays(self):
+        check_in = date.today() + timedelta(days=1)
+        bookings, errors = self.book_concurrently(ROOM_NUMBER, check_in, check_in + timedelta(days=3))
+
+        self.assertEqual(len(bookings), 1)
+        self.assertEqual(len(errors), ATTEMPTS - 1)
+        self.assertEqual(Booking.query().count(), 1)
+        self.assertEqual([stay[2] for stay in Room.get_by_number(ROOM_NUMBER).stays], [bookings[0].id])
+        self.assertEqual(counters.get_count(counters.ACTIVE_BOOKINGS), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()